@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_URL = os.environ.get("PPI_BACKEND_URL", "https://ppi-backend-ejsz.onrender.com")
+CONNECT_TIMEOUT = float(os.environ.get("PPI_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("PPI_READ_TIMEOUT", "600"))
+RETRIES = int(os.environ.get("PPI_RETRIES", "5"))
+BACKOFF_FACTOR = float(os.environ.get("PPI_BACKOFF_FACTOR", "2"))
+POOL_SIZE = int(os.environ.get("PPI_POOL_SIZE", "8"))
+# Overrides the version read from the backend
+BACKEND_VERSION = os.environ.get("PPI_BACKEND_VERSION") or None
+# How often the version is read again in the background, so a deploy is noticed
+VERSION_REFRESH = float(os.environ.get("PPI_VERSION_REFRESH_SECONDS", "300"))
+JOBS_DEFAULT = os.environ.get("PPI_ASYNC_JOBS", "0") == "1"
+JOB_POLL_INTERVAL = float(os.environ.get("PPI_JOB_POLL_SECONDS", "2"))
+# Polls run on the session's script thread; a missed poll is simply retried on the next tick
+POLL_TIMEOUT = float(os.environ.get("PPI_POLL_TIMEOUT", "5"))
+
+CROSS_CORRELATION = "/get-cross-correlation/"
+ANALYZE_DATA = "/analyze-data/"
+# Asynchronous variant: POST /jobs/<endpoint> returns a job ID, GET /jobs/<id>/result?since=N
+# returns a ZIP of the entries finished after the first N, with X-Job-Status and X-Entry-Count headers.
+JOBS = "/jobs"
+# FastAPI serves the app's version as info.version; a backend that reads Parquet uploads
+# lists it in info.x-upload-formats (e.g. ["xlsx", "parquet"])
+OPENAPI = "/openapi.json"
+
+# Render answers with these while a sleeping instance cold-starts
+RETRY_STATUSES = (502, 503, 504)
+# Answers from a backend that only understands .xlsx uploads
+UNSUPPORTED_UPLOAD_STATUSES = (400, 415, 422)
+
+
+class BackendError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BackendClient:
+    # One keep-alive session per backend, shared by every Streamlit session in the process.
+
+    def __init__(self, base_url=BACKEND_URL, retries=RETRIES, backoff_factor=BACKOFF_FACTOR, pool_size=POOL_SIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), poll_timeout=POLL_TIMEOUT, accept="application/zip",
+                 backend_version=BACKEND_VERSION, version_refresh=VERSION_REFRESH):
+        self.base_url = base_url.rstrip("/")
+        self.version_override = backend_version
+        self.backend_version = None
+        self.version_refresh = version_refresh
+        self.version_checked = None
+        self.version_probe = None
+        self.version_lock = threading.Lock()
+        self.upload_formats = ()
+        # Set when the backend turns a Parquet upload down, so later uploads go straight to .xlsx
+        self.parquet_rejected = False
+        self.timeout = timeout
+        self.poll_timeout = poll_timeout
+        self.accept = accept
+
+        # Only failed connects and cold-start statuses are retried. A read error or timeout means the upload
+        # reached the backend, and repeating it would queue the same analysis again.
+        retry = Retry(
+            total=retries,
+            read=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # POSTs too, for the cases above
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        poll_adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.poll_session = requests.Session()
+        self.poll_session.mount("http://", poll_adapter)
+        self.poll_session.mount("https://", poll_adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="backend")
+        # Asked right away (which also wakes a sleeping backend), so the version is usually known by the first upload
+        self.version()
+
+    def url(self, endpoint):
+        return self.base_url + endpoint
+
+    def version(self):
+        # Part of every cache key, so results computed before a backend deploy are not served after it.
+        # Never waits on the network: the last version read is returned and re-read in the background.
+        # None until the backend has answered once (it may be asleep), and then nothing is cached.
+        with self.version_lock:
+            stale = self.version_checked is None or time.monotonic() - self.version_checked >= self.version_refresh
+            if stale and self.version_probe is None:
+                self.version_probe = self.executor.submit(self._read_openapi)
+            return self.version_override or self.backend_version
+
+    def _read_openapi(self):
+        try:
+            response = self.poll_session.get(self.url(OPENAPI), timeout=self.poll_timeout)
+            response.raise_for_status()
+            info = response.json()["info"]
+            version = str(info["version"])
+            upload_formats = tuple(info.get("x-upload-formats", ()))
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            # The last known version stays in use; the next call asks again
+            version = None
+        with self.version_lock:
+            if version is not None:
+                if version != self.backend_version:
+                    # A new deploy may read Parquet after all
+                    self.parquet_rejected = False
+                self.backend_version = version
+                self.upload_formats = upload_formats
+                self.version_checked = time.monotonic()
+            self.version_probe = None
+
+    def reject_parquet(self):
+        self.parquet_rejected = True
+
+    def post_file(self, endpoint, file_name, file_bytes, accept=None):
+        response = self.session.post(
+            self.url(endpoint), files={"file": (file_name, file_bytes)}, headers={"Accept": accept or self.accept},
+            timeout=self.timeout, stream=True
+        )
+        if response.status_code != 200:
+            raise BackendError(response.text, response.status_code)
+        return response
+
+    def submit_job(self, endpoint, file_name, file_bytes):
+        response = self.session.post(
+            self.url(JOBS + endpoint), files={"file": (file_name, file_bytes)}, timeout=self.timeout
+        )
+        if response.status_code not in (200, 202):
+            raise BackendError(response.text, response.status_code)
+        return response.json()["job_id"]
+
+    def poll_job(self, job_id, since=0):
+        response = self.poll_session.get(
+            self.url(f"{JOBS}/{job_id}/result"), params={"since": since}, headers={"Accept": "application/zip"},
+            timeout=self.poll_timeout
+        )
+        if response.status_code != 200:
+            raise BackendError(response.text, response.status_code)
+        return response.headers.get("X-Job-Status", "done"), response.content, int(response.headers.get("X-Entry-Count", 0))
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
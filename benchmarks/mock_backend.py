@@ -0,0 +1,120 @@
+# Synthetic stand-in for /get-cross-correlation/ and /analyze-data/, used by run_benchmarks.py.
+#
+#     python benchmarks/mock_backend.py --port 8002 --patients 50 --criteria 13 --size 400
+#     PPI_BACKEND_URL=http://localhost:8002 streamlit run main.py
+#
+# Every request can override the cohort shape with ?patients=&criteria=&size=&latency=.
+# Responses carry X-Processing-Seconds so clients can split upload from backend time.
+import argparse
+import io
+import random
+import time
+import zipfile
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image, ImageDraw
+
+CROSS_CORRELATION = "/get-cross-correlation/"
+ANALYZE_DATA = "/analyze-data/"
+
+ANALYSIS_TYPES = ["classification", "regression"]
+ANALYSIS_TARGETS = ["MR area cm2", "MR VC mm"]
+ANALYSIS_METRICS = ["actual_vs_predicted", "feature_importance"]
+
+# Distinct images per size; entries cycle through them
+VARIANTS = 8
+
+
+@lru_cache(maxsize=16)
+def synthetic_pngs(size):
+    # Plot-like images (white background, axes, a curve) compress like the real backend output
+    width, height = size, size * 3 // 4
+    images = []
+    for variant in range(VARIANTS):
+        rng = random.Random(variant)
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+        draw.line([(20, 10), (20, height - 20), (width - 10, height - 20)], fill="black", width=2)
+        points = [(20 + x, height / 2 + rng.uniform(-0.4, 0.4) * height) for x in range(0, width - 30, max(width // 40, 1))]
+        draw.line(points, fill="steelblue", width=2)
+        draw.text((30, 12), f"synthetic {variant}", fill="black")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def cross_correlation_names(patients, criteria):
+    # patient_X_row_crit_vs_col.png with two-word row criteria, as main.py parses them
+    for patient in range(1, patients + 1):
+        for row in range(criteria):
+            for col in range(criteria):
+                yield f"patient_{patient}_param_{row}_vs_param_{col}_unit.png"
+
+
+def analysis_names():
+    # type_target_metric.png
+    for type in ANALYSIS_TYPES:
+        for target in ANALYSIS_TARGETS:
+            for metric in ANALYSIS_METRICS:
+                yield f"{type}_{target}_{metric}.png"
+
+
+def synthetic_zip(names, size):
+    pngs = synthetic_pngs(size)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for i, name in enumerate(names):
+            zip_file.writestr(name, pngs[i % len(pngs)])
+    return buffer.getvalue()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    defaults = {"patients": 10, "criteria": 13, "size": 400, "latency": 0.0}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        params = {key: type(value)(query.get(key, value)) for key, value in self.defaults.items()}
+
+        if url.path == CROSS_CORRELATION:
+            body = synthetic_zip(cross_correlation_names(params["patients"], params["criteria"]), params["size"])
+        elif url.path == ANALYZE_DATA:
+            body = synthetic_zip(analysis_names(), params["size"])
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        time.sleep(params["latency"])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Processing-Seconds", f"{time.perf_counter() - started:.6f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=0, **defaults):
+    MockHandler.defaults = {**MockHandler.defaults, **defaults}
+    return ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic backend for benchmarks")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--criteria", type=int, default=13)
+    parser.add_argument("--size", type=int, default=400, help="image width in pixels")
+    parser.add_argument("--latency", type=float, default=0.0, help="extra seconds of simulated backend work")
+    args = parser.parse_args()
+
+    serve(args.port, patients=args.patients, criteria=args.criteria, size=args.size, latency=args.latency).serve_forever()
@@ -0,0 +1,182 @@
+# End-to-end benchmark of the result pipeline against the synthetic backend in mock_backend.py.
+#
+#     python benchmarks/run_benchmarks.py --patients 5,20,50 --criteria 8,13 --sizes 200,400 --output bench.jsonl
+#
+# Both endpoints are swept unless --endpoints picks one; /analyze-data/ answers the same eight images
+# whatever the cohort, so its cases vary only patients (upload size) and image size, with criteria null.
+# Each case runs in its own process so peak RSS is per case. One JSON object per case is written,
+# tagged with its endpoint, with stage timings in seconds: upload, wait (backend), download, unzip (open + index),
+# decode_page / render_page (one gallery page as main.py shows it) and, with --full-cohort,
+# decode_all / render_all (every page, as main2.py shows them).
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def synthetic_workbook(patients, frames=30):
+    import numpy as np
+    import pandas as pd
+    from workbook import COLUMNS
+
+    rng = np.random.default_rng(0)
+    rows = [
+        [patient, frame // 10 + 1, frame % 10 + 1, frame, *(rng.random(8) + 1), 800]
+        for patient in range(1, patients + 1) for frame in range(frames)
+    ]
+    buffer = io.BytesIO()
+    pd.DataFrame(rows, columns=COLUMNS).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def run_case(base_url, endpoint, patients, criteria, size, full_cohort):
+    from backend_client import CROSS_CORRELATION, BackendClient
+    from download import download_result
+    from result_zip import ResultZip, index_analysis, index_cross_correlation
+    from thumbnails import column_width, encode_thumbnail
+
+    baseline_rss = peak_rss_mb()
+    workbook = synthetic_workbook(patients)
+    client = BackendClient(base_url, retries=0)
+    timings = {}
+
+    started = time.perf_counter()
+    query = f"patients={patients}&size={size}" + (f"&criteria={criteria}" if criteria is not None else "")
+    response = client.post_file(f"{endpoint}?{query}", "cohort.xlsx", workbook)
+    headers_received = time.perf_counter()
+    timings["wait"] = float(response.headers["X-Processing-Seconds"])
+    timings["upload"] = max(headers_received - started - timings["wait"], 0.0)
+
+    data = download_result(response)
+    downloaded = time.perf_counter()
+    timings["download"] = downloaded - headers_received
+
+    result = ResultZip(data)
+    index_entries = index_cross_correlation if endpoint == CROSS_CORRELATION else index_analysis
+    layout = [
+        (page, grid, sorted({col for row_data in grid.values() for col in row_data}))
+        for page, grid in index_entries(result.namelist()).items()
+    ]
+    timings["unzip"] = time.perf_counter() - downloaded
+
+    def decode_and_render(pages):
+        decode = render = 0.0
+        for _, grid, col_headers in pages:
+            width = column_width(len(col_headers))
+            for col_data in grid.values():
+                for name in col_data.values():
+                    began = time.perf_counter()
+                    image = result.decode(name)
+                    decoded = time.perf_counter()
+                    encode_thumbnail(image, width)
+                    decode += decoded - began
+                    render += time.perf_counter() - decoded
+        return decode, render
+
+    timings["decode_page"], timings["render_page"] = decode_and_render(layout[:1])
+    if full_cohort:
+        timings["decode_all"], timings["render_all"] = decode_and_render(layout)
+
+    return {
+        "endpoint": endpoint,
+        "patients": patients,
+        "criteria": criteria,
+        "size": size,
+        "images": len(result.namelist()),
+        "upload_bytes": len(workbook),
+        "download_bytes": len(data),
+        "timings": {stage: round(seconds, 6) for stage, seconds in timings.items()},
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def endpoint_list(value):
+    from backend_client import ANALYZE_DATA, CROSS_CORRELATION
+
+    endpoints = {"cross-correlation": CROSS_CORRELATION, "analyze-data": ANALYZE_DATA}
+    try:
+        return [endpoints[item] for item in value.split(",")]
+    except KeyError as e:
+        raise argparse.ArgumentTypeError(f"unknown endpoint {e}; choose from {', '.join(endpoints)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the frontend result pipeline")
+    parser.add_argument("--endpoints", type=endpoint_list, default="cross-correlation,analyze-data")
+    parser.add_argument("--patients", type=int_list, default=[5, 20, 50])
+    parser.add_argument("--criteria", type=int_list, default=[8, 13])
+    parser.add_argument("--sizes", type=int_list, default=[200, 400], help="image widths in pixels")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated backend seconds per request")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--full-cohort", action="store_true", help="also decode and render every page")
+    parser.add_argument("--output", help="JSON lines file (default: stdout)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(**json.loads(args.case))))
+        return
+
+    from benchmarks.mock_backend import serve
+
+    server = serve(latency=args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        from backend_client import CROSS_CORRELATION
+
+        cases = [
+            (endpoint, patients, criteria, size, run)
+            for endpoint in args.endpoints
+            for patients, criteria, size, run in itertools.product(
+                args.patients, args.criteria if endpoint == CROSS_CORRELATION else [None], args.sizes, range(args.repeat)
+            )
+        ]
+        for endpoint, patients, criteria, size, run in cases:
+            case = {"base_url": base_url, "endpoint": endpoint, "patients": patients, "criteria": criteria,
+                    "size": size, "full_cohort": args.full_cohort}
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                capture_output=True, text=True, check=True, cwd=ROOT,
+            )
+            record = json.loads(completed.stdout.strip().splitlines()[-1])
+            record.update(run=run, python=platform.python_version(), timestamp=time.time())
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+    finally:
+        server.shutdown()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
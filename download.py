@@ -0,0 +1,93 @@
+import io
+import mmap
+import os
+import struct
+import tempfile
+import zipfile
+import zlib
+from collections import OrderedDict
+
+from PIL import Image
+
+from thumbnails import encode_thumbnail
+
+CHUNK_SIZE = int(os.environ.get("PPI_DOWNLOAD_CHUNK_KB", "1024")) * 1024
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+class PartialZip:
+    # Indexes ZIP entries from their local headers while the archive is still being downloaded,
+    # so the first pages can be drawn before the central directory arrives.
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.offset = 0
+        self.entries = OrderedDict()
+        self.thumbnails = {}
+        self.done = False
+
+    def scan(self):
+        size = self.spool.seek(0, os.SEEK_END)
+        new_entries = []
+        while not self.done and size - self.offset >= LOCAL_HEADER.size:
+            self.spool.seek(self.offset)
+            header = LOCAL_HEADER.unpack(self.spool.read(LOCAL_HEADER.size))
+            signature, _, flags, method, _, _, _, compress_size, _, name_length, extra_length = header
+
+            # Central directory reached, or an entry whose size is only known after its data
+            if signature != LOCAL_HEADER_SIGNATURE or flags & 0x08 or compress_size == 0xFFFFFFFF \
+                    or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                self.done = True
+                break
+
+            data_offset = self.offset + LOCAL_HEADER.size + name_length + extra_length
+            if data_offset + compress_size > size:
+                break
+
+            name = self.spool.read(name_length).decode("utf-8" if flags & 0x800 else "cp437")
+            self.entries[name] = (data_offset, compress_size, method)
+            new_entries.append(name)
+            self.offset = data_offset + compress_size
+
+        self.spool.seek(0, os.SEEK_END)
+        return new_entries
+
+    def namelist(self):
+        return list(self.entries)
+
+    def load_image(self, name):
+        data_offset, compress_size, method = self.entries[name]
+        self.spool.seek(data_offset)
+        data = self.spool.read(compress_size)
+        self.spool.seek(0, os.SEEK_END)
+
+        if method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -15)
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def load_thumbnail(self, name, width):
+        # Kept for the preview's redraws and handed on to the finished result (ResultZip.add_thumbnails)
+        key = (name, width)
+        if key not in self.thumbnails:
+            self.thumbnails[key] = encode_thumbnail(self.load_image(name), width)
+        return self.thumbnails[key]
+
+
+def download_result(response, on_entries=None):
+    # Streams the response body to a temp file and returns it memory-mapped.
+    # `on_entries(partial_zip)` is called whenever new complete entries are available.
+    with tempfile.TemporaryFile() as spool:
+        partial_zip = PartialZip(spool)
+        for chunk in response.iter_content(CHUNK_SIZE):
+            spool.write(chunk)
+            if on_entries is not None and not partial_zip.done and partial_zip.scan():
+                on_entries(partial_zip)
+
+        spool.flush()
+        if spool.tell() == 0:
+            return b""
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,153 @@
+# Local stand-in for the backend's job API, for trying the asynchronous mode without the real backend.
+#
+#     python job_server.py --port 8001 --delay 1
+#     PPI_BACKEND_URL=http://localhost:8001 streamlit run main.py
+#
+# Cross-correlation jobs are computed per patient with the local engine; analyze-data jobs are
+# forwarded to --upstream and published once it answers.
+import argparse
+import io
+import json
+import threading
+import time
+import uuid
+import zipfile
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from backend_client import ANALYZE_DATA, BACKEND_URL, CROSS_CORRELATION, JOBS
+from local_engine import COL_LABELS, ROW_LABELS, patient_correlations, plot_lags
+from workbook import prepare_upload
+
+
+class Job:
+    def __init__(self):
+        self.status = "running"
+        self.error = None
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def publish(self, entries):
+        with self.lock:
+            self.entries.extend(entries)
+
+    def finish(self, error=None):
+        with self.lock:
+            self.status = "failed" if error else "done"
+            self.error = error
+
+
+def run_cross_correlation(job, file_bytes, delay):
+    data, errors = prepare_upload(file_bytes)
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    for patient_id, lags, correlations in patient_correlations(data):
+        time.sleep(delay)
+        entries = []
+        for i, row_label in enumerate(ROW_LABELS):
+            for j, col_label in enumerate(COL_LABELS):
+                png = io.BytesIO()
+                plot_lags(lags, correlations[:, i, j]).save(png, format="PNG")
+                entries.append((f"patient_{patient_id}_{row_label}_vs_{col_label}.png", png.getvalue()))
+        job.publish(entries)
+
+
+def run_analysis(job, file_name, file_bytes, upstream):
+    response = requests.post(upstream.rstrip("/") + ANALYZE_DATA, files={"file": (file_name, file_bytes)})
+    if response.status_code != 200:
+        raise ValueError(response.text)
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
+        job.publish([(name, zip_file.read(name)) for name in zip_file.namelist()])
+
+
+def run_job(job, target, *args):
+    try:
+        target(job, *args)
+        job.finish()
+    except Exception as e:
+        job.finish(str(e))
+
+
+def read_upload(headers, body):
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+    )
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_filename() or "upload.xlsx", part.get_payload(decode=True)
+    raise ValueError("No file in upload")
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    jobs = {}
+    delay = 0.0
+    upstream = BACKEND_URL
+
+    def send(self, status, body, content_type="application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path not in (JOBS + CROSS_CORRELATION, JOBS + ANALYZE_DATA):
+            return self.send(404, b"Not found", "text/plain")
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        try:
+            file_name, file_bytes = read_upload(self.headers, body)
+        except ValueError as e:
+            return self.send(400, str(e).encode(), "text/plain")
+
+        job_id = uuid.uuid4().hex
+        job = self.jobs[job_id] = Job()
+        if path == JOBS + CROSS_CORRELATION:
+            args = (run_cross_correlation, file_bytes, self.delay)
+        else:
+            args = (run_analysis, file_name, file_bytes, self.upstream)
+        threading.Thread(target=run_job, args=(job, *args), daemon=True).start()
+
+        self.send(202, json.dumps({"job_id": job_id}).encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 3 or "/" + parts[0] != JOBS or parts[2] != "result" or parts[1] not in self.jobs:
+            return self.send(404, b"Unknown job", "text/plain")
+
+        job = self.jobs[parts[1]]
+        since = int(parse_qs(url.query).get("since", ["0"])[0])
+        with job.lock:
+            if job.status == "failed":
+                return self.send(500, job.error.encode(), "text/plain")
+            status = job.status
+            entries = job.entries[since:]
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_file:
+            for name, data in entries:
+                zip_file.writestr(name, data)
+        self.send(200, buffer.getvalue(), "application/zip",
+                  headers=[("X-Job-Status", status), ("X-Entry-Count", str(len(entries)))])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in job server for the asynchronous backend API")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before each patient")
+    parser.add_argument("--upstream", default=BACKEND_URL, help="backend that answers analyze-data jobs")
+    args = parser.parse_args()
+
+    JobHandler.delay = args.delay
+    JobHandler.upstream = args.upstream
+    ThreadingHTTPServer(("", args.port), JobHandler).serve_forever()
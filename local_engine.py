@@ -0,0 +1,107 @@
+import io
+import os
+import zipfile
+
+import numpy as np
+import pyarrow as pa
+from PIL import Image, ImageDraw
+
+from result_table import CROSS_CORRELATION_KIND, SCHEMA, write_table
+from workbook import PARAMETERS
+
+LOCAL_ENGINE_VERSION = "local-1"
+LOCAL_ENGINE_DEFAULT = os.environ.get("PPI_LOCAL_ENGINE", "0") == "1"
+MAX_LAG = int(os.environ.get("PPI_LOCAL_MAX_LAG", "10"))
+
+# File name labels used by the backend: two-word row criteria, full column name for the columns
+ROW_LABELS = ["_".join(parameter.split()[:2]) for parameter in PARAMETERS]
+COL_LABELS = [parameter.replace(" ", "_") for parameter in PARAMETERS]
+
+PLOT_SIZE = (320, 240)
+
+
+def lagged_cross_correlation(values, max_lag=MAX_LAG):
+    # values: (time, parameter). Returns lags and r[lag, i, j] = corr(x_i[t + lag], x_j[t]) for every pair at once.
+    length = values.shape[0]
+    std = values.std(axis=0)
+    standardized = np.divide(values - values.mean(axis=0), std, out=np.zeros_like(values), where=std > 0)
+
+    n = 1 << int(np.ceil(np.log2(max(2 * length - 1, 1))))
+    spectrum = np.fft.rfft(standardized, n=n, axis=0)
+    cross = np.fft.irfft(spectrum[:, :, None] * np.conj(spectrum[:, None, :]), n=n, axis=0) / length
+
+    max_lag = min(max_lag, length - 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    return lags, cross[lags]
+
+
+def plot_lags(lags, correlations, size=PLOT_SIZE):
+    width, height = size
+    left, right, top, bottom = 30, 10, 24, 20
+    plot_height = height - top - bottom
+    zero_y = top + plot_height / 2
+    step = (width - left - right) / len(lags)
+
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.line([(left, top), (left, height - bottom)], fill="black")
+    draw.line([(left, zero_y), (width - right, zero_y)], fill="black")
+    draw.text((2, top - 6), "1", fill="black")
+    draw.text((2, height - bottom - 6), "-1", fill="black")
+
+    peak = int(np.argmax(np.abs(correlations)))
+    for i, value in enumerate(correlations):
+        x = left + step * (i + 0.5)
+        y = zero_y - value * plot_height / 2
+        color = "crimson" if i == peak else "steelblue"
+        draw.line([(x, zero_y), (x, y)], fill=color, width=max(int(step * 0.6), 1))
+
+    draw.text((left, 4), f"peak r={correlations[peak]:.2f} at lag {lags[peak]}", fill="black")
+    draw.text((left, height - bottom + 4), f"lag {lags[0]} .. {lags[-1]}", fill="black")
+    return image
+
+
+def patient_correlations(data, max_lag=MAX_LAG):
+    # data: a validated sheet as returned by workbook.prepare_upload
+    for patient_id, rows in data.groupby("Patient ID", sort=False):
+        rows = rows.sort_values(["Cycle", "Frame"])
+        values = rows[PARAMETERS].to_numpy(dtype=float)
+        if len(values) < 2:
+            continue
+
+        lags, correlations = lagged_cross_correlation(values, max_lag)
+        yield patient_id, lags, correlations
+
+
+def cross_correlation_zip(data, max_lag=MAX_LAG):
+    # Produces the same patient_X_row_crit_vs_col.png entries as /get-cross-correlation/
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_file:
+        for patient_id, lags, correlations in patient_correlations(data, max_lag):
+            for i, row_label in enumerate(ROW_LABELS):
+                for j, col_label in enumerate(COL_LABELS):
+                    png = io.BytesIO()
+                    plot_lags(lags, correlations[:, i, j]).save(png, format="PNG")
+                    zip_file.writestr(f"patient_{patient_id}_{row_label}_vs_{col_label}.png", png.getvalue())
+    return buffer.getvalue()
+
+
+def cross_correlation_table(data, max_lag=MAX_LAG):
+    # Same results as cross_correlation_zip, as an Arrow stream of coefficients per lag
+    columns = {name: [] for name in SCHEMA.names}
+    rows = [label.replace("_", " ") for label in ROW_LABELS]
+    cols = [label.replace("_", " ") for label in COL_LABELS]
+
+    for patient_id, lags, correlations in patient_correlations(data, max_lag):
+        cells = len(rows) * len(cols)
+        columns["group"].extend([f"patient: {patient_id}"] * cells * len(lags))
+        columns["row"].extend(np.repeat(rows, len(cols) * len(lags)))
+        columns["col"].extend(np.tile(np.repeat(cols, len(lags)), len(rows)))
+        columns["x"].extend(np.tile(lags, cells).astype(float))
+        # (lag, row, col) -> (row, col, lag) so each cell's lags are contiguous
+        columns["y"].extend(correlations.transpose(1, 2, 0).ravel())
+
+    length = len(columns["group"])
+    columns["kind"] = [CROSS_CORRELATION_KIND] * length
+    columns["label"] = [None] * length
+    return write_table(pa.table(columns, schema=SCHEMA))
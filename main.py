@@ -1,9 +1,480 @@
-import streamlit as st
-import requests
-import zipfile
-import io
-from PIL import Image
+import os
+import tempfile
 from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import streamlit as st
+from backend_client import (
+    ANALYZE_DATA, CROSS_CORRELATION, JOB_POLL_INTERVAL, JOBS_DEFAULT, POOL_SIZE, UNSUPPORTED_UPLOAD_STATUSES,
+    BackendClient, BackendError,
+)
+from download import download_result
+from local_engine import LOCAL_ENGINE_DEFAULT, LOCAL_ENGINE_VERSION, cross_correlation_table, cross_correlation_zip
+from metrics import DEBUG_PANEL_DEFAULT, RECENT_TRACES, Metrics, Trace
+from result_cache import ResultCache, cache_key
+from result_store import SharedResultStore
+from result_table import ARROW_STREAM_MAGIC, RESULT_FORMAT, ResultTable, accept_header, is_result
+from result_zip import ResultZip, index_analysis, index_cross_correlation, index_sources, merge_patient_results
+from prefetch import Prefetcher
+from report import export_report
+from thumbnails import column_width
+from workbook import (
+    PARQUET_MAGIC, UPLOAD_FORMAT, expand_batch, frame_parquet, parquet_name, parse_upload, patient_fingerprints,
+    patient_parquet, prepare_upload, upload_parquet, upload_workbook,
+)
+
+# Workbooks of a batch sent to the backend at once
+BATCH_CONCURRENCY = int(os.environ.get("PPI_BATCH_CONCURRENCY", "4"))
+BATCH_REFRESH_SECONDS = 0.5
+INCREMENTAL_DEFAULT = os.environ.get("PPI_INCREMENTAL", "1") == "1"
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+result_cache = get_result_cache()
+
+@st.cache_resource
+def get_backend():
+    return BackendClient(accept=accept_header())
+
+backend = get_backend()
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher()
+
+prefetcher = get_prefetcher()
+
+# Opened results live here, once per distinct payload; sessions hold handles to them
+@st.cache_resource
+def get_result_store():
+    return SharedResultStore()
+
+result_store = get_result_store()
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+metrics = get_metrics()
+
+def sends_parquet():
+    if UPLOAD_FORMAT == "xlsx" or backend.parquet_rejected:
+        return False
+    return UPLOAD_FORMAT == "parquet" or "parquet" in backend.upload_formats
+
+def post_upload(post, endpoint, file_name, file_bytes, parquet=None):
+    if sends_parquet():
+        # Patient subsets and batch workbooks come with their Parquet and stay out of upload_parquet's cache
+        if parquet is None:
+            parquet = file_bytes if file_bytes[:4] == PARQUET_MAGIC else upload_parquet(file_bytes)
+        try:
+            return post(endpoint, parquet_name(file_name), parquet)
+        except BackendError as e:
+            # Older backends only read .xlsx; send the original workbook, and only that from now on
+            if e.status_code not in UNSUPPORTED_UPLOAD_STATUSES:
+                raise
+            backend.reject_parquet()
+    return post(endpoint, file_name, upload_workbook(file_bytes))
+
+def result_key(endpoint, file_bytes, accept):
+    return cache_key(file_bytes, f"{backend.url(endpoint)}|{accept}", backend.version())
+
+def fetch_result(endpoint, file_name, file_bytes, trace, on_entries=None, accept=None, parquet=None):
+    accept = accept or backend.accept
+    key = result_key(endpoint, file_bytes, accept)
+    with trace.span("cache"):
+        zip_bytes = result_cache.get(key)
+
+    if zip_bytes is None:
+        # Upload and backend compute until the response headers arrive; the first-patient preview is part of download
+        with trace.span("request"):
+            response = post_upload(
+                lambda *args: backend.post_file(*args, accept=accept), endpoint, file_name, file_bytes, parquet
+            )
+        if "X-Processing-Seconds" in response.headers:
+            trace.add_time("backend", float(response.headers["X-Processing-Seconds"]))
+        trace.count("upload_bytes", len(response.request.body or b""))
+
+        with trace.span("download"):
+            zip_bytes = download_result(response, on_entries=on_entries)
+        if is_result(zip_bytes):
+            with trace.span("cache"):
+                result_cache.put(key, zip_bytes)
+        trace.count("download_bytes", len(zip_bytes))
+    else:
+        trace.count("cache_hits")
+    return zip_bytes
+
+def fetch_local_result(file_bytes, trace):
+    key = cache_key(file_bytes, f"local{CROSS_CORRELATION}|{RESULT_FORMAT}", LOCAL_ENGINE_VERSION)
+    with trace.span("cache"):
+        zip_bytes = result_cache.get(key)
+
+    if zip_bytes is None:
+        with trace.span("compute"):
+            data, _ = prepare_upload(file_bytes)
+            if RESULT_FORMAT == "arrow":
+                zip_bytes = cross_correlation_table(data)
+            else:
+                zip_bytes = cross_correlation_zip(data)
+        with trace.span("cache"):
+            result_cache.put(key, zip_bytes)
+    else:
+        trace.count("cache_hits")
+    return zip_bytes
+
+def fetch_changed_patients(file_name, file_bytes, previous, trace, on_entries=None):
+    # Sends only the patients whose rows differ from `previous` (Patient ID -> fingerprint, result cache key, entries
+    # of the last run) and reuses the rest. Returns the parts of the merged result and the patients for the next run.
+    data, _ = prepare_upload(file_bytes)
+    fingerprints = patient_fingerprints(data)
+    unchanged = [patient_id for patient_id, fingerprint in fingerprints.items()
+                 if patient_id in previous and previous[patient_id][0] == fingerprint]
+    # Archives of the last run are read back from the result cache; patients whose archive was evicted are sent again
+    with trace.span("cache"):
+        archives = {key: result_cache.get(key) for key in {previous[patient_id][1] for patient_id in unchanged}}
+    changed = {patient_id for patient_id in fingerprints
+               if patient_id not in unchanged or archives[previous[patient_id][1]] is None}
+    trace.count("patients", len(fingerprints))
+    trace.count("patients_sent", len(changed))
+
+    key, names = None, []
+    if changed:
+        reused = len(changed) < len(fingerprints)
+        if reused:
+            # Built from the parsed rows; an .xlsx is only written for a backend that does not take Parquet
+            file_name, file_bytes = f"{os.path.splitext(file_name)[0]}_changed.xlsx", patient_parquet(data, changed)
+        # Reused patients are merged entry by entry, which needs ZIPs; a full run negotiates the format as usual
+        accept = "application/zip" if reused else backend.accept
+        key = result_key(CROSS_CORRELATION, file_bytes, accept)
+        zip_bytes = fetch_result(CROSS_CORRELATION, file_name, file_bytes, trace, on_entries=on_entries, accept=accept)
+        if bytes(zip_bytes[:4]) == ARROW_STREAM_MAGIC:
+            # Tables are not split by patient, so there is nothing to reuse and the next run sends everyone
+            return [(zip_bytes, None, None)], OrderedDict()
+        archives[key] = zip_bytes
+        if zip_bytes:
+            names = ResultZip(zip_bytes).namelist()
+
+    # Deleted patients are left out; pages keep the workbook's patient order
+    parts, patients = merge_patient_results(fingerprints, previous, changed, key, names)
+    if changed and not reused:
+        # Nothing was reused, so the answer is shown whole whatever its entries are named
+        return [(archives[key], None, None)], patients
+    return [(archives[archive_key], None, entry_names) for archive_key, entry_names in parts], patients
+
+def previous_patients():
+    previous = st.session_state.get("cross_correlation_patients")
+    if previous and previous["backend"] == f"{backend.url(CROSS_CORRELATION)}|{backend.version()}":
+        return previous["patients"]
+    return {}
+
+def load_patients(parts, patients, trace):
+    st.session_state.cross_correlation_patients = {
+        "backend": f"{backend.url(CROSS_CORRELATION)}|{backend.version()}", "patients": patients
+    }
+    with trace.span("unzip"):
+        show_cross_correlation(result_store.open_parts(parts))
+    trace.count("images", image_count(st.session_state.patient_layout))
+
+    sent, total = trace.counts["patients_sent"], trace.counts["patients"]
+    if sent < total:
+        st.info(f"♻️ Resubmitted {sent} of {total} patients; the others are unchanged since the last run.")
+
+def load_result(data, show, layout_key, trace):
+    # "unzip": reading the ZIP directory (or Arrow stream) and indexing its pages
+    with trace.span("unzip"):
+        show(result_store.open(data))
+    trace.count("images", image_count(st.session_state[layout_key]))
+
+def image_count(layout):
+    return sum(len(col_data) for _, grid, _ in layout for col_data in grid.values())
+
+def finish_trace(trace):
+    entry = metrics.record(trace)
+    traces = st.session_state.setdefault("traces", [])
+    traces.append(entry)
+    del traces[:-RECENT_TRACES]
+
+def result_index(result, index_entries):
+    if isinstance(result, ResultTable):
+        return result.index
+    if result.sources:
+        return index_sources(result.sources, index_entries)
+    return index_entries(result.namelist())
+
+def reindex_cross_correlation():
+    patient_images = result_index(st.session_state.patient_zip.result, index_cross_correlation)
+
+    st.session_state.patient_images = patient_images
+    st.session_state.patient_layout = grid_layout(patient_images)
+
+def show_cross_correlation(patient_zip):
+    st.session_state.patient_zip = patient_zip
+    reindex_cross_correlation()
+    prefetcher.cancel(st.session_state.setdefault("patient_prefetch", {}))
+    st.session_state.patient_counter = 0
+    st.session_state.cross_correlation = True
+
+def reindex_analysis():
+    analysis_images = result_index(st.session_state.analysis_zip.result, index_analysis)
+    st.session_state.analysis_images = analysis_images
+    st.session_state.analysis_layout = grid_layout(analysis_images)
+
+def show_analysis(analysis_zip):
+    st.session_state.analysis_zip = analysis_zip
+    reindex_analysis()
+    prefetcher.cancel(st.session_state.setdefault("type_prefetch", {}))
+    st.session_state.type_counter = 0
+    st.session_state.analysis_prediction = True
+
+def grid_layout(images):
+    # Column headers per page are computed once when results load, not on every rerun
+    return [
+        (page, grid, sorted({col for row_data in grid.values() for col in row_data.keys()}))
+        for page, grid in images.items()
+    ]
+
+def draw_grid(result, grid, col_headers, caption_separator, trace):
+    width = column_width(len(col_headers))
+    for row_criteria, col_data in grid.items():
+        row = st.columns(len(col_headers))
+        for i, col_criteria in enumerate(col_headers):
+            if col_criteria in col_data:
+                caption = f"{row_criteria}{caption_separator}{col_criteria}"
+                if isinstance(result, ResultTable):
+                    with trace.span("decode"):
+                        chart = result.chart(col_data[col_criteria])
+                    with trace.span("render"):
+                        row[i].altair_chart(chart, use_container_width=True)
+                        row[i].caption(caption)
+                else:
+                    # PIL decode and thumbnail encode on a cache miss, a lookup otherwise
+                    with trace.span("decode"):
+                        image = result.load_thumbnail(col_data[col_criteria], width)
+                    with trace.span("render"):
+                        row[i].image(image=image, caption=caption, output_format="JPEG")
+                    trace.count("drawn_image_bytes", len(image))
+                trace.count("drawn_images")
+
+@st.dialog("Full resolution", width="large")
+def zoom_dialog(result, name, caption):
+    st.image(image=result.load_image(name), caption=caption)
+
+def zoom_control(result, grid, caption_separator, key):
+    # Thumbnails are display-sized; this opens the original image of one cell
+    if isinstance(result, ResultTable):
+        return
+
+    entries = {
+        f"{row_criteria}{caption_separator}{col_criteria}": name
+        for row_criteria, col_data in grid.items() for col_criteria, name in col_data.items()
+    }
+    def request_zoom():
+        st.session_state[f"{key}_request"] = st.session_state[key]
+        st.session_state[key] = None
+
+    st.selectbox("🔍 View full resolution", options=list(entries), index=None, key=key, on_change=request_zoom)
+    caption = st.session_state.pop(f"{key}_request", None)
+    if caption in entries:
+        zoom_dialog(result, entries[caption], caption)
+
+def preview_first_patient(preview, partial_zip, drawn, trace):
+    # Redraw the first patient's grid while the rest of the ZIP is still downloading.
+    # Thumbnails stay cached on the PartialZip, so a redraw only encodes the cells that arrived since the last one.
+    patient_images = index_cross_correlation(partial_zip.namelist())
+    if not patient_images:
+        return
+
+    first_patient, comparisons = list(patient_images.items())[0]
+    count = sum(len(col_data) for col_data in comparisons.values())
+    if drawn.get("count") == count:
+        return
+    drawn["count"] = count
+    drawn["thumbnails"] = partial_zip.thumbnails
+
+    with preview.container():
+        st.subheader(f"📊 Results for {first_patient}")
+        draw_grid(partial_zip, comparisons, grid_layout({first_patient: comparisons})[0][2], " vs ", trace)
+
+def keep_preview_thumbnails(drawn):
+    # The finished result starts with the thumbnails the preview already encoded instead of decoding them again
+    result = st.session_state.patient_zip.result
+    if isinstance(result, ResultZip) and "thumbnails" in drawn:
+        result.add_thumbnails(drawn["thumbnails"])
+
+def run_batch(endpoint, workbooks, concurrency, trace):
+    # workbooks: (name, bytes, Parquet body or None). Sends at most `concurrency` at a time;
+    # returns (name, result ZIP) in upload order and errors by name
+    progress = {name: "⏸️ Queued" for name, _, _ in workbooks}
+
+    def process(name, file_bytes, parquet):
+        progress[name] = "🔄 Processing..."
+        def received(partial_zip):
+            progress[name] = f"⬇️ {len(partial_zip.namelist())} images received"
+        # Batches are merged entry by entry, so they always ask for ZIPs
+        zip_bytes = fetch_result(
+            endpoint, name, file_bytes, trace, on_entries=received, accept="application/zip", parquet=parquet
+        )
+        progress[name] = "✅ Done"
+        return zip_bytes
+
+    overall = st.progress(0.0)
+    placeholders = {name: st.empty() for name, _, _ in workbooks}
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        futures = {pool.submit(process, *workbook): workbook[0] for workbook in workbooks}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=BATCH_REFRESH_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = str(e)
+                    progress[name] = f"❌ {e}"
+            # Worker threads have no script context, so the page is updated from here
+            for name, placeholder in placeholders.items():
+                placeholder.caption(f"{name}: {progress[name]}")
+            finished = len(futures) - len(pending)
+            overall.progress(finished / len(futures), text=f"{finished} of {len(futures)} files processed")
+
+    return [(name, results[name]) for name, _, _ in workbooks if results.get(name)], errors
+
+# Job kind (the session flag of its gallery) -> endpoint, result attribute, show, reindex
+JOB_KINDS = {
+    "cross_correlation": (CROSS_CORRELATION, "patient_zip", show_cross_correlation, reindex_cross_correlation),
+    "analysis_prediction": (ANALYZE_DATA, "analysis_zip", show_analysis, reindex_analysis),
+}
+
+def attach_job(kind, job_id):
+    # The job ID is kept in the URL so a refreshed or reconnected page picks the job up again
+    _, _, show, _ = JOB_KINDS[kind]
+    st.session_state.jobs[kind] = {"id": job_id, "since": 0}
+    st.query_params[f"{kind}_job"] = job_id
+    show(result_store.adopt(ResultZip()))
+
+def detach_job(kind):
+    if st.session_state.jobs.pop(kind, None):
+        del st.query_params[f"{kind}_job"]
+
+def start_job(kind, file_name, file_bytes):
+    endpoint, _, _, _ = JOB_KINDS[kind]
+    attach_job(kind, post_upload(backend.submit_job, endpoint, file_name, file_bytes))
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_poller():
+    updated = False
+    for kind, job in list(st.session_state.jobs.items()):
+        _, result_key, _, reindex = JOB_KINDS[kind]
+        trace = Trace(f"{kind}_job")
+        try:
+            with trace.span("poll"):
+                status, data, count = backend.poll_job(job["id"], job["since"])
+        except BackendError as e:
+            status, count = "failed", 0
+            st.session_state.job_errors.append(str(e))
+            trace.count("errors")
+        except Exception:
+            # Network hiccup: try again on the next tick
+            continue
+
+        if count:
+            with trace.span("unzip"):
+                st.session_state[result_key].result.append(data)
+                reindex()
+            trace.count("download_bytes", len(data))
+            trace.count("images", count)
+            job["since"] += count
+            updated = True
+
+        # Empty polls are not recorded, they would drown the rest
+        if count or status == "failed":
+            finish_trace(trace)
+
+        if status != "running":
+            del st.session_state.jobs[kind]
+            del st.query_params[f"{kind}_job"]
+            if status == "done" and not job["since"]:
+                st.session_state.job_errors.append("The job finished without any results.")
+            # Nothing to show: close the gallery instead of leaving it waiting for results that will not come
+            if status == "failed" or not job["since"]:
+                st.session_state[kind] = False
+                st.session_state.pop(result_key, None)
+            updated = True
+
+    if updated:
+        st.rerun()
+    st.caption("⏳ Processing in the background, results appear as they are ready...")
+
+# The galleries are fragments: Next/Previous rerun and resend only the grid, not the whole page
+@st.fragment
+def patient_gallery():
+    def next():
+        if st.session_state.patient_counter < len(st.session_state.patient_layout) - 1:
+            st.session_state.patient_counter += 1
+    def prev():
+        if st.session_state.patient_counter > 0:
+            st.session_state.patient_counter -= 1
+
+    if not st.session_state.patient_layout:
+        st.info("⏳ Waiting for the first patient...")
+        return
+
+    patient_zip = st.session_state.patient_zip.result
+    selected_patient, comparisons, col_headers = st.session_state.patient_layout[st.session_state.patient_counter]
+    st.subheader(f"📊 Results for {selected_patient}")
+
+    trace = Trace("patient_gallery")
+    draw_grid(patient_zip, comparisons, col_headers, " vs ", trace)
+    finish_trace(trace)
+    result_store.evict()
+    zoom_control(patient_zip, comparisons, " vs ", key="patient_zoom")
+
+    cols = st.columns(2)
+    with cols[1]: st.button("Next ➡️", on_click=next, use_container_width=True, key="patient_next")
+    with cols[0]: st.button("⬅️ Previous", on_click=prev, use_container_width=True, key="patient_prev")
+
+    if not isinstance(patient_zip, ResultTable):
+        prefetcher.update(
+            patient_zip, st.session_state.patient_layout, st.session_state.patient_counter,
+            st.session_state.patient_prefetch
+        )
+
+@st.fragment
+def analysis_gallery():
+    def next():
+        if st.session_state.type_counter < len(st.session_state.analysis_layout) - 1:
+            st.session_state.type_counter += 1
+    def prev():
+        if st.session_state.type_counter > 0:
+            st.session_state.type_counter -= 1
+
+    if not st.session_state.analysis_layout:
+        st.info("⏳ Waiting for the first results...")
+        return
+
+    analysis_zip = st.session_state.analysis_zip.result
+    selected_type, predictions, col_headers = st.session_state.analysis_layout[st.session_state.type_counter]
+    st.subheader(selected_type)
+
+    trace = Trace("analysis_gallery")
+    draw_grid(analysis_zip, predictions, col_headers, ": ", trace)
+    finish_trace(trace)
+    result_store.evict()
+    zoom_control(analysis_zip, predictions, ": ", key="type_zoom")
+
+    cols = st.columns(2)
+    with cols[1]: st.button("Next ➡️", on_click=next, use_container_width=True, key="type_next")
+    with cols[0]: st.button("⬅️ Previous", on_click=prev, use_container_width=True, key="type_prev")
+
+    if not isinstance(analysis_zip, ResultTable):
+        prefetcher.update(
+            analysis_zip, st.session_state.analysis_layout, st.session_state.type_counter,
+            st.session_state.type_prefetch
+        )
 
 st.title("🫀Mitral Insights Analyzer")
 st.markdown(
@@ -67,178 +538,269 @@ if "cross_correlation" not in st.session_state:
 if "analysis_prediction" not in st.session_state:
     st.session_state.analysis_prediction = False
 
+if "jobs" not in st.session_state:
+    st.session_state.jobs = {}
+    st.session_state.job_errors = []
+    for kind in JOB_KINDS:
+        if f"{kind}_job" in st.query_params:
+            attach_job(kind, st.query_params[f"{kind}_job"])
+
 uploaded_file = st.file_uploader("Upload your Excel file with patience data here", type=['xlsx'])
 
 if uploaded_file is not None:
-    st.success("File uploaded successfully!")
-    cross_correlation_button = st.button("Process File for Cross Correlation")
-    analysis_prediction_button = st.button("Process File for Analysis and Prediction")
+    file_name = uploaded_file.name
+    file_bytes = uploaded_file.getvalue()
+
+    try:
+        _, validation_errors = prepare_upload(file_bytes)
+    except Exception as e:
+        validation_errors = [f"The file could not be read: {str(e)}"]
+
+    if validation_errors:
+        st.error("❌ The file does not match the expected structure:\n\n" + "\n".join(f"- {error}" for error in validation_errors))
+    else:
+        st.success("File uploaded successfully!")
+    use_local_engine = st.toggle("Compute cross correlation locally (offline)", value=LOCAL_ENGINE_DEFAULT)
+    use_jobs = st.toggle("Run as background job", value=JOBS_DEFAULT)
+    use_incremental = st.toggle("Only reprocess patients that changed since the last run", value=INCREMENTAL_DEFAULT)
+    cross_correlation_button = st.button("Process File for Cross Correlation", disabled=bool(validation_errors))
+    analysis_prediction_button = st.button("Process File for Analysis and Prediction", disabled=bool(validation_errors))
+    run_all_button = st.button("Run all", disabled=bool(validation_errors))
 
     if cross_correlation_button:
         st.session_state.analysis_prediction = False
+        detach_job("cross_correlation")
+        trace = Trace("cross_correlation")
         try:
-            with st.spinner("Processing the file..."):
-                files = {"file": uploaded_file}
-                response = requests.post("https://ppi-backend-ejsz.onrender.com/get-cross-correlation/", files=files)
-
-                if response.status_code == 200:
-                    st.success("File processed successfully! Retrieving results...")
-
-                    zip_content = io.BytesIO(response.content)
-
-                    patient_images = OrderedDict()
-
-                    with zipfile.ZipFile(zip_content, 'r') as zip_ref:
-                        for file_name in zip_ref.namelist():
-                            if file_name.endswith('.png'):
-                                parts = file_name.split('_')
-                                if len(parts) >= 5:
-                                    patient = parts[0] + ": " + parts[1]
-                                    row_criteria = parts[2] + " " + parts[3]
-                                    col_criteria = " ".join(parts[5:]).replace(".png", "")
-                                    image = Image.open(zip_ref.open(file_name))
-
-                                    if patient not in patient_images:
-                                        patient_images[patient] = OrderedDict()
-
-                                    if row_criteria not in patient_images[patient]:
-                                        patient_images[patient][row_criteria] = OrderedDict()
-
-                                    patient_images[patient][row_criteria][col_criteria] = image
-
-                    st.session_state.patient_images = patient_images
-                    st.session_state.cross_correlation = True
+            with st.spinner("Processing the file..."), trace.span("total"):
+                if use_local_engine:
+                    load_result(fetch_local_result(file_bytes, trace), show_cross_correlation, "patient_layout", trace)
+                elif use_jobs:
+                    with trace.span("request"):
+                        start_job("cross_correlation", file_name, file_bytes)
                 else:
-                    st.error(f"❌ Failed to process the file. Error: {response.text}")
+                    preview = st.empty()
+                    drawn = {}
+                    on_entries = lambda partial_zip: preview_first_patient(preview, partial_zip, drawn, trace)
+                    if use_incremental:
+                        parts, patients = fetch_changed_patients(
+                            file_name, file_bytes, previous_patients(), trace, on_entries=on_entries
+                        )
+                        preview.empty()
+                        load_patients(parts, patients, trace)
+                    else:
+                        zip_bytes = fetch_result(CROSS_CORRELATION, file_name, file_bytes, trace, on_entries=on_entries)
+                        preview.empty()
+                        load_result(zip_bytes, show_cross_correlation, "patient_layout", trace)
+                    keep_preview_thumbnails(drawn)
+
+                if use_jobs and not use_local_engine:
+                    st.success("Job submitted! Results appear below as they are ready.")
+                else:
+                    st.success("File processed successfully! Retrieving results...")
 
+        except BackendError as e:
+            trace.count("errors")
+            st.error(f"❌ Failed to process the file. Error: {e}")
         except Exception as e:
+            trace.count("errors")
             st.error(f"⚠️ An error occurred: {str(e)}")
-    if st.session_state.cross_correlation:
-    
-        def next(): 
-            if st.session_state.patient_counter < len(st.session_state.patient_images) - 1:
-                st.session_state.patient_counter += 1
-        def prev(): 
-            if st.session_state.patient_counter > 0:
-                st.session_state.patient_counter -= 1
-
-        if 'patient_counter' not in st.session_state: st.session_state.patient_counter = 0
-
-        patient_images = st.session_state.patient_images
-        patient_list = list(patient_images.keys())
-        selected_patient = patient_list[st.session_state.patient_counter]
-
-        comparisons = patient_images[selected_patient]
-        st.subheader(f"📊 Results for {selected_patient}")
-
-        col_headers = sorted({col for row_data in comparisons.values() for col in row_data.keys()})
-
-        for row_criteria, col_data in comparisons.items():
-            row = st.columns(len(col_headers))
-            for i, col_criteria in enumerate(col_headers):
-                if col_criteria in col_data:
-                    image = col_data[col_criteria]
-                    row[i].image(image=image, caption=f"{row_criteria} vs {col_criteria}")
-
-        cols = st.columns(2)
-        with cols[1]: st.button("Next ➡️", on_click=next, use_container_width=True)
-        with cols[0]: st.button("⬅️ Previous", on_click=prev, use_container_width=True) 
-
-            
+        finish_trace(trace)
+
     if analysis_prediction_button:
         st.session_state.cross_correlation = False
+        detach_job("analysis_prediction")
+        trace = Trace("analysis_prediction")
         try:
-            with st.spinner("Processing the file..."):
-                files = {"file": uploaded_file}
-                response = requests.post("https://ppi-backend-ejsz.onrender.com/analyze-data/", files=files)
-
-                if response.status_code == 200:
-                    st.success("File processed successfully! Retrieving results...")
+            with st.spinner("Processing the file..."), trace.span("total"):
+                if use_jobs:
+                    with trace.span("request"):
+                        start_job("analysis_prediction", file_name, file_bytes)
+                else:
+                    zip_bytes = fetch_result(ANALYZE_DATA, file_name, file_bytes, trace)
+                    load_result(zip_bytes, show_analysis, "analysis_layout", trace)
 
-                    zip_content = io.BytesIO(response.content)
-
-                    analysis_images = OrderedDict()
-
-                    with zipfile.ZipFile(zip_content, 'r') as zip_ref:
-                        for file_name in zip_ref.namelist():
-                            if file_name.endswith('.png'):
-                                parts = file_name.split('_')
-                                if len(parts) >= 4:
-                                    type = parts[0]
-                                    row_criteria = parts[1]
-                                    col_criteria = " ".join(parts[2:]).replace(".png", "")
-                                    image = Image.open(zip_ref.open(file_name))
-
-                                    if type not in analysis_images:
-                                        analysis_images[type] = OrderedDict()
-
-                                    if row_criteria not in analysis_images[type]:
-                                        analysis_images[type][row_criteria] = OrderedDict()
-
-                                    analysis_images[type][row_criteria][col_criteria] = image
-
-                    # image_files = ["classification_MR area cm2_actual_vs_predicted.png", "classification_MR area cm2_feature_importance.png",
-                    #                "classification_MR VC mm_actual_vs_predicted.png", "classification_MR VC mm_feature_importance.png",
-                    #                "regression_MR area cm2_actual_vs_predicted.png", "regression_MR area cm2_feature_importance.png",
-                    #                "regression_MR VC mm_actual_vs_predicted.png", "regression_MR VC mm_feature_importance.png"]
-                    # for file_name in image_files:
-                    #     if file_name.endswith('.png'):
-                    #         parts = file_name.split('_')
-                    #         if len(parts) >= 4:
-                    #             type = parts[0]
-                    #             row_criteria = parts[1]
-                    #             col_criteria = " ".join(parts[2:]).replace(".png", "")
-                    #             image = Image.open(file_name)
-
-                    #             if type not in analysis_images:
-                    #                 analysis_images[type] = OrderedDict()
-
-                    #             if row_criteria not in analysis_images[type]:
-                    #                 analysis_images[type][row_criteria] = OrderedDict()
-
-                    #             analysis_images[type][row_criteria][col_criteria] = image
-                    
-                    st.session_state.analysis_images = analysis_images
-                    st.session_state.analysis_prediction = True
-
-    
+                if use_jobs:
+                    st.success("Job submitted! Results appear below as they are ready.")
                 else:
-                    st.error(f"❌ Failed to process the file. Error: {response.text}")
+                    st.success("File processed successfully! Retrieving results...")
 
+        except BackendError as e:
+            trace.count("errors")
+            st.error(f"❌ Failed to process the file. Error: {e}")
         except Exception as e:
+            trace.count("errors")
             st.error(f"An error occurred: {str(e)}")
+        finish_trace(trace)
+
+    if run_all_button:
+        detach_job("cross_correlation")
+        detach_job("analysis_prediction")
+        # One trace per path; "run_all" holds the wall time of both together
+        trace = Trace("run_all")
+        cross_correlation_trace = Trace("cross_correlation")
+        analysis_trace = Trace("analysis_prediction")
+        try:
+            with st.spinner("Processing the file..."), trace.span("total"):
+                if use_jobs:
+                    if use_local_engine:
+                        load_result(
+                            fetch_local_result(file_bytes, cross_correlation_trace), show_cross_correlation,
+                            "patient_layout", cross_correlation_trace
+                        )
+                    else:
+                        with cross_correlation_trace.span("request"):
+                            start_job("cross_correlation", file_name, file_bytes)
+                    with analysis_trace.span("request"):
+                        start_job("analysis_prediction", file_name, file_bytes)
+                else:
+                    # Both analyses are in flight at once, so the wait is the slower of the two
+                    if use_local_engine:
+                        cross_correlation_result = backend.submit(fetch_local_result, file_bytes, cross_correlation_trace)
+                    elif use_incremental:
+                        cross_correlation_result = backend.submit(
+                            fetch_changed_patients, file_name, file_bytes, previous_patients(), cross_correlation_trace
+                        )
+                    else:
+                        cross_correlation_result = backend.submit(
+                            fetch_result, CROSS_CORRELATION, file_name, file_bytes, cross_correlation_trace
+                        )
+                    analysis_result = backend.submit(fetch_result, ANALYZE_DATA, file_name, file_bytes, analysis_trace)
+
+                    if use_incremental and not use_local_engine:
+                        load_patients(*cross_correlation_result.result(), cross_correlation_trace)
+                    else:
+                        load_result(
+                            cross_correlation_result.result(), show_cross_correlation, "patient_layout",
+                            cross_correlation_trace
+                        )
+                    load_result(analysis_result.result(), show_analysis, "analysis_layout", analysis_trace)
+
+                if use_jobs:
+                    st.success("Job submitted! Results appear below as they are ready.")
+                else:
+                    st.success("File processed successfully! Retrieving results...")
 
-    if st.session_state.analysis_prediction:
-
-        def next(): 
-            if st.session_state.type_counter < len(st.session_state.analysis_images) - 1:
-                st.session_state.type_counter += 1
-        def prev(): 
-            if st.session_state.type_counter > 0:
-                st.session_state.type_counter -= 1
-
-        if 'type_counter' not in st.session_state: st.session_state.type_counter = 0
-
-        analysis_images = st.session_state.analysis_images
-        type_list = list(analysis_images.keys())
-        selected_type = type_list[st.session_state.type_counter]
-
-        predictions = analysis_images[selected_type]
-        st.subheader(selected_type)
-
-        col_headers = set()
-        for row_data in predictions.values():
-            col_headers.update(row_data.keys())
-        col_headers = sorted(col_headers)
-
-        for row_criteria, col_data in predictions.items():
-            row = st.columns(spec=len(col_headers))
-            for i, col_criteria in enumerate(col_headers):
-                if col_criteria in col_data:
-                    image = col_data[col_criteria]
-                    row[i].image(image=image, caption=f"{row_criteria}: {col_criteria}")
-
-        cols = st.columns(2)
-        with cols[1]: st.button("Next ➡️", on_click=next, use_container_width=True)
-        with cols[0]: st.button("⬅️ Previous", on_click=prev, use_container_width=True) 
+        except BackendError as e:
+            trace.count("errors")
+            st.error(f"❌ Failed to process the file. Error: {e}")
+        except Exception as e:
+            trace.count("errors")
+            st.error(f"⚠️ An error occurred: {str(e)}")
+        for finished in (cross_correlation_trace, analysis_trace, trace):
+            finish_trace(finished)
 
+with st.expander("📁 Batch analysis: several workbooks or a .zip folder of them"):
+    batch_files = st.file_uploader(
+        "Upload workbooks or a .zip archive", type=["xlsx", "zip"], accept_multiple_files=True, key="batch_files"
+    )
+    if batch_files:
+        batch_kind = st.radio(
+            "Analysis", list(JOB_KINDS), horizontal=True, key="batch_kind",
+            format_func=lambda kind: "Cross correlation" if kind == "cross_correlation" else "Analysis and prediction"
+        )
+        concurrency = st.number_input(
+            "Files processed at once", min_value=1, max_value=POOL_SIZE, value=min(BATCH_CONCURRENCY, POOL_SIZE),
+            key="batch_concurrency"
+        )
+
+        if st.button("Process batch", key="batch_run"):
+            trace = Trace(f"{batch_kind}_batch")
+            try:
+                with trace.span("total"):
+                    workbooks, invalid = [], []
+                    parquet_uploads = sends_parquet()
+                    for name, file_bytes in expand_batch([(file.name, file.getvalue()) for file in batch_files]):
+                        # Each workbook is parsed once, here; its upload body is built from the same rows
+                        try:
+                            data, validation_errors = parse_upload(file_bytes)
+                        except Exception as e:
+                            validation_errors = [f"The file could not be read: {str(e)}"]
+                        if validation_errors:
+                            invalid.append(f"- {name}: {'; '.join(validation_errors)}")
+                        else:
+                            workbooks.append((name, file_bytes, frame_parquet(data) if parquet_uploads else None))
+                    if invalid:
+                        st.error("❌ Skipped files that do not match the expected structure:\n\n" + "\n".join(invalid))
+
+                    endpoint, _, show, _ = JOB_KINDS[batch_kind]
+                    results, errors = run_batch(endpoint, workbooks, concurrency, trace) if workbooks else ([], {})
+                    for name, error in errors.items():
+                        st.error(f"❌ Failed to process {name}. Error: {error}")
+                    trace.count("files", len(results))
+
+                    if results:
+                        for kind in JOB_KINDS:
+                            st.session_state[kind] = False
+                            detach_job(kind)
+                        # One navigator over every file; pages are keyed by source file and patient
+                        with trace.span("unzip"):
+                            show(result_store.open_parts([(data, name, None) for name, data in results]))
+                        st.success(f"Processed {len(results)} of {len(workbooks) + len(invalid)} files.")
+            except Exception as e:
+                trace.count("errors")
+                st.error(f"⚠️ An error occurred: {str(e)}")
+            finish_trace(trace)
+
+# Outside the upload block so results of a reattached job show after a page refresh
+for error in st.session_state.job_errors:
+    st.error(f"❌ Failed to process the file. Error: {error}")
+st.session_state.job_errors = []
+
+if st.session_state.jobs:
+    job_poller()
+
+if st.session_state.cross_correlation:
+    patient_gallery()
+
+if st.session_state.analysis_prediction:
+    analysis_gallery()
+
+if st.session_state.cross_correlation or st.session_state.analysis_prediction:
+    if st.button("📄 Export report", key="export_report"):
+        trace = Trace("export")
+        sections = []
+        if st.session_state.cross_correlation:
+            sections.append(("Cross correlation", st.session_state.patient_zip.result, st.session_state.patient_layout, " vs "))
+        if st.session_state.analysis_prediction:
+            sections.append(("Analysis and prediction", st.session_state.analysis_zip.result, st.session_state.analysis_layout, ": "))
+
+        progress = st.progress(0.0, text="Rendering the report...")
+        try:
+            # Pages are written to disk as they finish, so rendering only holds the pages in flight
+            with tempfile.TemporaryFile() as report, trace.span("total"):
+                pages = export_report(
+                    sections, report,
+                    on_page=lambda done, total: progress.progress(done / total, text=f"{done} of {total} pages rendered")
+                )
+                trace.count("pages", pages)
+                trace.count("report_bytes", report.tell())
+                # st.download_button keeps its data in the server's memory until the session reruns, so the
+                # whole archive is held once per exporting session: peak memory grows with the report size
+                report.seek(0)
+                st.download_button(
+                    "⬇️ Download report (.zip)", data=report.read(), file_name="mitral_insights_report.zip",
+                    mime="application/zip", key="download_report"
+                )
+        except Exception as e:
+            trace.count("errors")
+            st.error(f"⚠️ The report could not be exported: {str(e)}")
+        finish_trace(trace)
+
+# Opt-in with PPI_DEBUG_PANEL=1 or ?debug=1
+if DEBUG_PANEL_DEFAULT or st.query_params.get("debug") == "1":
+    with st.expander("🛠️ Debug: stage timings"):
+        rows = [
+            {"path": entry["path"], **{f"{stage} s": seconds for stage, seconds in entry["stages"].items()}, **entry["counts"]}
+            for entry in reversed(st.session_state.get("traces", []))
+        ]
+        if rows:
+            st.dataframe(rows, use_container_width=True)
+        else:
+            st.caption("Nothing timed yet in this session.")
+        stats = result_store.stats()
+        st.caption(
+            f"Shared results: {stats['results']} ({stats['referenced']} in use), "
+            f"{stats['bytes'] / 2**20:.1f} of {stats['budget'] / 2**20:.0f} MB"
+        )
+        st.code(metrics.prometheus_text(), language="text")
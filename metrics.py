@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+DEBUG_PANEL_DEFAULT = os.environ.get("PPI_DEBUG_PANEL", "0") == "1"
+# JSON lines, one per finished trace: a file path, "-" for stderr, empty to disable
+METRICS_LOG = os.environ.get("PPI_METRICS_LOG", "")
+# Prometheus text exposition file (e.g. for node_exporter's textfile collector), empty to disable
+METRICS_FILE = os.environ.get("PPI_METRICS_FILE", "")
+
+# Processing paths and gallery draws kept per session for the debug panel
+RECENT_TRACES = 20
+
+logger = logging.getLogger("ppi.metrics")
+
+
+class Trace:
+    # Timing spans and counts of one processing run or gallery draw.
+    # Spans with the same stage name add up, so a stage can be timed per image.
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.stages = OrderedDict()
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - began)
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "path": self.path,
+                "started": self.started,
+                "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+                "counts": dict(self.counts),
+            }
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    # Process-wide totals of every finished trace, exported as JSON logs and Prometheus text.
+
+    def __init__(self, log_target=METRICS_LOG, metrics_file=METRICS_FILE):
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.stage_seconds = OrderedDict()  # (path, stage) -> [sum, count]
+        self.counts = OrderedDict()  # (path, name) -> total
+        self.lock = threading.Lock()
+
+        if log_target and not logger.handlers:
+            handler = logging.StreamHandler() if log_target == "-" else logging.FileHandler(log_target)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+    def record(self, trace):
+        entry = trace.to_dict()
+        with self.lock:
+            for stage, seconds in entry["stages"].items():
+                totals = self.stage_seconds.setdefault((trace.path, stage), [0.0, 0])
+                totals[0] += seconds
+                totals[1] += 1
+            for name, value in entry["counts"].items():
+                self.counts[(trace.path, name)] = self.counts.get((trace.path, name), 0) + value
+
+        logger.info(json.dumps(entry))
+        if self.metrics_file:
+            self.write_file(self.prometheus_text())
+        return entry
+
+    def prometheus_text(self):
+        with self.lock:
+            stage_seconds = [(key, tuple(totals)) for key, totals in self.stage_seconds.items()]
+            counts = list(self.counts.items())
+
+        lines = [
+            "# HELP ppi_stage_seconds Time spent per processing stage.",
+            "# TYPE ppi_stage_seconds summary",
+        ]
+        for (path, stage), (seconds, count) in stage_seconds:
+            labels = f'path="{escape_label(path)}",stage="{escape_label(stage)}"'
+            lines.append(f"ppi_stage_seconds_sum{{{labels}}} {seconds:.6f}")
+            lines.append(f"ppi_stage_seconds_count{{{labels}}} {count}")
+
+        for name in dict.fromkeys(name for (_, name), _ in counts):
+            lines.append(f"# TYPE ppi_{name}_total counter")
+            for (path, counted), value in counts:
+                if counted == name:
+                    lines.append(f'ppi_{name}_total{{path="{escape_label(path)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, text):
+        # Written next to the target and renamed so a scrape never reads half a file
+        self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.metrics_file.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as tmp:
+                tmp.write(text)
+            os.replace(tmp_path, self.metrics_file)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,59 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from thumbnails import column_width
+
+# Pages prefetched on each side of the current one
+PREFETCH_DEPTH = int(os.environ.get("PPI_PREFETCH_DEPTH", "1"))
+PREFETCH_WORKERS = int(os.environ.get("PPI_PREFETCH_WORKERS", "2"))
+
+
+def neighbours(page, pages, depth=PREFETCH_DEPTH):
+    # Next page first: paging forward through a cohort is the common case
+    order = []
+    for distance in range(1, depth + 1):
+        for candidate in (page + distance, page - distance):
+            if 0 <= candidate < pages:
+                order.append(candidate)
+    return order
+
+
+def warm_page(result, grid, col_headers, cancelled):
+    width = column_width(len(col_headers))
+    for col_data in grid.values():
+        for name in col_data.values():
+            if cancelled.is_set():
+                return
+            result.load_thumbnail(name, width)
+
+
+class Prefetcher:
+    # Decodes and encodes the pages around the one on screen into the result's thumbnail cache.
+
+    def __init__(self, workers=PREFETCH_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def update(self, result, layout, page, jobs, depth=PREFETCH_DEPTH):
+        # jobs: {page: (future, cancelled)} kept in the caller's session state
+        wanted = neighbours(page, len(layout), depth)
+
+        for job_page in list(jobs):
+            future, cancelled = jobs[job_page]
+            if job_page not in wanted:
+                # The user jumped elsewhere: stop work that is no longer next to the current page
+                cancelled.set()
+                future.cancel()
+                del jobs[job_page]
+
+        for job_page in wanted:
+            if job_page not in jobs:
+                _, grid, col_headers = layout[job_page]
+                cancelled = threading.Event()
+                jobs[job_page] = (self.executor.submit(warm_page, result, grid, col_headers, cancelled), cancelled)
+
+    def cancel(self, jobs):
+        for future, cancelled in jobs.values():
+            cancelled.set()
+            future.cancel()
+        jobs.clear()
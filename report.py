@@ -0,0 +1,189 @@
+import html
+import io
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from local_engine import PLOT_SIZE, plot_lags
+from result_table import CROSS_CORRELATION_KIND, FEATURE_IMPORTANCE_KIND, ResultTable
+from thumbnails import column_width, encode_thumbnail
+
+EXPORT_WORKERS = int(os.environ.get("PPI_EXPORT_WORKERS", str(os.cpu_count() or 1)))
+REPORT_WIDTH = int(os.environ.get("PPI_REPORT_WIDTH", "1200"))
+# Pages handed to the pool ahead of the one being written; bounds memory to a few pages
+PAGES_IN_FLIGHT_PER_WORKER = 2
+
+STYLE = """
+body { font-family: sans-serif; margin: 24px; }
+table { border-collapse: collapse; }
+td { padding: 4px; vertical-align: top; text-align: center; font-size: 12px; }
+img { width: 100%; }
+nav { margin: 12px 0; }
+"""
+
+
+def page_name(number):
+    return f"pages/{number:05d}.html"
+
+
+def html_document(title, body, prefix=""):
+    return (
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{html.escape(title)}</title>"
+        f"<link rel='stylesheet' href='{prefix}style.css'></head><body>{body}</body></html>"
+    )
+
+
+def plot_feature_importance(labels, importances, size=PLOT_SIZE):
+    width, height = size
+    left, right, top = 110, 10, 8
+    order = sorted(range(len(importances)), key=lambda i: -importances[i])
+    step = (height - 2 * top) / max(len(order), 1)
+    scale = (width - left - right) / max(max(importances, default=0), 1e-9)
+
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.line([(left, top), (left, height - top)], fill="black")
+    for position, i in enumerate(order):
+        y = top + step * position
+        draw.rectangle([(left, y + step * 0.2), (left + max(importances[i], 0) * scale, y + step * 0.8)], fill="steelblue")
+        draw.text((2, y + step * 0.5 - 5), str(labels[i])[:18], fill="black")
+    return image
+
+
+def plot_actual_vs_predicted(actual, predicted, size=PLOT_SIZE):
+    width, height = size
+    left, right, top, bottom = 30, 10, 10, 20
+    low = min(min(actual, default=0), min(predicted, default=0))
+    high = max(max(actual, default=1), max(predicted, default=1))
+    span = (high - low) or 1
+
+    def point(x, y):
+        return (left + (x - low) / span * (width - left - right), height - bottom - (y - low) / span * (height - top - bottom))
+
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.line([(left, top), (left, height - bottom), (width - right, height - bottom)], fill="black")
+    # Perfect predictions lie on the diagonal
+    draw.line([point(low, low), point(high, high)], fill="lightgray")
+    for x, y in zip(actual, predicted):
+        cx, cy = point(x, y)
+        draw.ellipse([(cx - 2, cy - 2), (cx + 2, cy + 2)], fill="steelblue")
+    draw.text((left, height - bottom + 4), f"actual {low:.3g} .. {high:.3g}", fill="black")
+    return image
+
+
+def plot_table_cell(kind, x, y, labels):
+    # The Altair charts of result_table.ResultTable.chart, drawn with Pillow for the report
+    if kind == CROSS_CORRELATION_KIND:
+        return plot_lags([int(lag) for lag in x], y)
+    if kind == FEATURE_IMPORTANCE_KIND:
+        return plot_feature_importance(labels, y)
+    return plot_actual_vs_predicted(x, y)
+
+
+def render_page(number, pages, section, title, rows, col_headers):
+    # Runs in a worker process. rows: [(row criteria, {col criteria: (caption, kind, payload)})] where kind is
+    # "png" (the entry's bytes) or "table" (kind, x, y, labels and CSV of a table result's cell).
+    # Returns the page HTML and its assets.
+    width = column_width(len(col_headers), REPORT_WIDTH)
+    assets = []
+    table = ["<table><tr>", *(f"<th>{html.escape(col)}</th>" for col in col_headers), "</tr>"]
+    for row_criteria, cells in rows:
+        table.append("<tr>")
+        for col_criteria in col_headers:
+            if col_criteria not in cells:
+                table.append("<td></td>")
+                continue
+
+            caption, kind, payload = cells[col_criteria]
+            asset = f"assets/{number:05d}_{len(assets):03d}"
+            if kind == "png":
+                image = Image.open(io.BytesIO(payload))
+                cell = ""
+            else:
+                table_kind, x, y, labels, csv = payload
+                image = plot_table_cell(table_kind, x, y, labels)
+                assets.append((f"{asset}.csv", csv.encode()))
+                cell = f"<div><a href='../{asset}.csv'>data (.csv)</a></div>"
+            assets.append((f"{asset}.jpg", encode_thumbnail(image, width)))
+            cell = f"<img src='../{asset}.jpg' alt='{html.escape(caption)}'>{cell}"
+            table.append(f"<td style='width: {width}px'>{cell}<div>{html.escape(caption)}</div></td>")
+        table.append("</tr>")
+    table.append("</table>")
+
+    links = ["<a href='../index.html'>Index</a>"]
+    if number > 0:
+        links.insert(0, f"<a href='../{page_name(number - 1)}'>⬅️ Previous</a>")
+    if number < pages - 1:
+        links.append(f"<a href='../{page_name(number + 1)}'>Next ➡️</a>")
+    nav = f"<nav>{' | '.join(links)}</nav>"
+
+    body = f"{nav}<h3>{html.escape(section)}</h3><h2>{html.escape(title)}</h2>{''.join(table)}{nav}"
+    return html_document(title, body, prefix="../"), assets
+
+
+def page_cells(result, grid, caption_separator):
+    # Read in the parent: entries stay compressed in the retained ZIP until their page is next in line
+    rows = []
+    for row_criteria, col_data in grid.items():
+        cells = {}
+        for col_criteria, name in col_data.items():
+            caption = f"{row_criteria}{caption_separator}{col_criteria}"
+            if isinstance(result, ResultTable):
+                frame = result.frame(name)
+                payload = (
+                    frame["kind"].iloc[0], frame["x"].tolist(), frame["y"].tolist(), frame["label"].tolist(),
+                    frame.to_csv(index=False),
+                )
+                cells[col_criteria] = (caption, "table", payload)
+            else:
+                cells[col_criteria] = (caption, "png", result.read(name))
+        rows.append((row_criteria, cells))
+    return rows
+
+
+def export_report(sections, output, title="Mitral Insights report", workers=EXPORT_WORKERS, on_page=None):
+    # sections: [(section title, result, layout, caption separator)], layout as built by main.grid_layout.
+    # Writes an HTML + assets ZIP to the file object `output` one page at a time; returns the page count.
+    tasks = [
+        (section, result, page, grid, col_headers, caption_separator)
+        for section, result, layout, caption_separator in sections
+        for page, grid, col_headers in layout
+    ]
+    index = {}
+    workers = max(min(workers, len(tasks)), 1)
+
+    # Spawned workers do not inherit the server's threads and locks
+    context = multiprocessing.get_context("spawn")
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        in_flight = deque()
+        submitted = 0
+        for number in range(len(tasks)):
+            while submitted < len(tasks) and len(in_flight) < workers * PAGES_IN_FLIGHT_PER_WORKER:
+                section, result, page, grid, col_headers, caption_separator = tasks[submitted]
+                rows = page_cells(result, grid, caption_separator)
+                in_flight.append(pool.submit(render_page, submitted, len(tasks), section, page, rows, col_headers))
+                index.setdefault(section, []).append((submitted, page))
+                submitted += 1
+
+            page_html, assets = in_flight.popleft().result()
+            archive.writestr(page_name(number), page_html)
+            for asset, data in assets:
+                # JPEGs are already compressed
+                archive.writestr(asset, data, zipfile.ZIP_STORED if asset.endswith(".jpg") else zipfile.ZIP_DEFLATED)
+            if on_page is not None:
+                on_page(number + 1, len(tasks))
+
+        body = [f"<h1>{html.escape(title)}</h1>"]
+        for section, pages in index.items():
+            body.append(f"<h2>{html.escape(section)}</h2><ul>")
+            body.extend(f"<li><a href='{page_name(number)}'>{html.escape(page)}</a></li>" for number, page in pages)
+            body.append("</ul>")
+        archive.writestr("index.html", html_document(title, "".join(body)))
+        archive.writestr("style.css", STYLE)
+    return len(tasks)
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_DIR = Path(os.environ.get("PPI_CACHE_DIR", Path(tempfile.gettempdir()) / "ppi_result_cache"))
+MEMORY_BUDGET = int(os.environ.get("PPI_CACHE_MEMORY_MB", "256")) * 1024 * 1024
+DISK_BUDGET = int(os.environ.get("PPI_CACHE_DISK_MB", "2048")) * 1024 * 1024
+
+
+def cache_key(file_bytes, endpoint, backend_version):
+    # Same spreadsheet sent to the same endpoint of the same backend version -> same ZIP.
+    # None while the backend's version is unknown: such results are neither looked up nor stored.
+    if backend_version is None:
+        return None
+    file_digest = hashlib.sha256(file_bytes).hexdigest()
+    return hashlib.sha256(f"{endpoint}\0{backend_version}\0{file_digest}".encode()).hexdigest()
+
+
+class ResultCache:
+    # Two-tier LRU: recent results in memory, everything (size permitting) on local disk.
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()
+        self.memory_size = 0
+
+        # Rebuild the disk index oldest-first so eviction survives restarts
+        self.disk = OrderedDict()
+        self.disk_size = 0
+        entries = sorted(self.cache_dir.glob("*.zip"), key=lambda path: path.stat().st_mtime)
+        for path in entries:
+            size = path.stat().st_size
+            self.disk[path.stem] = size
+            self.disk_size += size
+        self._evict_disk()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.zip"
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+            if key not in self.disk:
+                return None
+
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except OSError:
+                self.disk_size -= self.disk.pop(key)
+                return None
+
+            self.disk.move_to_end(key)
+            self._put_memory(key, data)
+            return data
+
+    def put(self, key, data):
+        if key is None:
+            return
+        with self.lock:
+            self._put_memory(key, data)
+
+            if len(data) > self.disk_budget:
+                return
+            if key in self.disk:
+                self.disk_size -= self.disk.pop(key)
+
+            # Write to a temp file first so a concurrent reader never sees a partial ZIP
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    tmp_file.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+
+            self.disk[key] = len(data)
+            self.disk_size += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key, data):
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        if len(data) > self.memory_budget:
+            return
+
+        self.memory[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_budget:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def _evict_disk(self):
+        while self.disk_size > self.disk_budget:
+            key, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
@@ -0,0 +1,127 @@
+import hashlib
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict, deque
+
+from result_table import open_result
+from result_zip import ResultZip
+
+STORE_BUDGET = int(os.environ.get("PPI_SHARED_STORE_MB", "1024")) * 1024 * 1024
+
+
+class ResultHandle:
+    # What a session keeps in st.session_state: a key into the shared store.
+    # The store counts live handles; dropping the last one makes the result evictable.
+
+    def __init__(self, store, key):
+        self.key = key
+        self.store = store
+        # Finalizers can run in the middle of any allocation, so they only queue the key
+        weakref.finalize(self, store.released.append, key)
+
+    @property
+    def result(self):
+        return self.store.get(self.key)
+
+
+class SharedResultStore:
+    # One opened result (and its decoded/thumbnail caches) per distinct payload, shared by every session.
+    # Results nobody references are evicted first, least recently used; when the referenced ones alone
+    # are over budget their caches are dropped, oldest first, and rebuilt on demand.
+
+    def __init__(self, budget=STORE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.refs = {}
+        self.released = deque()
+        self.private_keys = itertools.count()
+        self.lock = threading.Lock()
+
+    def open(self, data):
+        # Identical payloads (the same cohort opened in several sessions) share one entry
+        key = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self._collect()
+            if key not in self.entries:
+                self.entries[key] = open_result(data)
+            return self._acquire(key)
+
+    def open_parts(self, parts):
+        # parts: (result ZIP, source, entry names or None for all), merged in order into one result.
+        # Batches and incremental re-runs built from the same archives share one entry.
+        if len(parts) == 1 and parts[0][1:] == (None, None):
+            # One whole payload, possibly an Arrow table, is opened like any other result
+            return self.open(parts[0][0])
+        digests = {}
+        digest = hashlib.sha256()
+        for data, source, names in parts:
+            if id(data) not in digests:
+                digests[id(data)] = hashlib.sha256(data).digest()
+            digest.update(digests[id(data)] + f"\0{source}\0{names}\0".encode())
+        key = f"parts-{digest.hexdigest()}"
+        with self.lock:
+            self._collect()
+            if key not in self.entries:
+                result = ResultZip()
+                for data, source, names in parts:
+                    result.append(data, source, names)
+                self.entries[key] = result
+            return self._acquire(key)
+
+    def adopt(self, result):
+        # Results that are still being appended to (background jobs) are not shared, only accounted for
+        with self.lock:
+            self._collect()
+            key = f"private-{next(self.private_keys)}"
+            self.entries[key] = result
+            return self._acquire(key)
+
+    def _acquire(self, key):
+        self.entries.move_to_end(key)
+        self.refs[key] = self.refs.get(key, 0) + 1
+        return ResultHandle(self, key)
+
+    def get(self, key):
+        with self.lock:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def _collect(self):
+        while self.released:
+            key = self.released.popleft()
+            self.refs[key] -= 1
+            if self.refs[key] == 0:
+                del self.refs[key]
+                if key.startswith("private-"):
+                    del self.entries[key]
+
+    def memory_size(self):
+        with self.lock:
+            self._collect()
+            results = list(self.entries.values())
+        return sum(result.memory_size() for result in results)
+
+    def evict(self):
+        size = self.memory_size()
+        with self.lock:
+            self._collect()
+            for key in [key for key in self.entries if key not in self.refs]:
+                if size <= self.budget:
+                    return
+                size -= self.entries.pop(key).memory_size()
+
+            results = list(self.entries.values())
+
+        for result in results:
+            if size <= self.budget:
+                return
+            before = result.memory_size()
+            result.trim()
+            size -= before - result.memory_size()
+
+    def stats(self):
+        size = self.memory_size()
+        with self.lock:
+            return {"results": len(self.entries), "referenced": len(self.refs), "bytes": size, "budget": self.budget}
@@ -0,0 +1,111 @@
+import os
+from collections import OrderedDict
+
+import altair as alt
+import numpy as np
+import pyarrow as pa
+
+from download import LOCAL_HEADER_SIGNATURE
+from result_zip import ResultZip
+
+RESULT_FORMAT = os.environ.get("PPI_RESULT_FORMAT", "arrow")
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_STREAM_MAGIC = b"\xff\xff\xff\xff"
+
+CROSS_CORRELATION_KIND = "cross_correlation"
+ACTUAL_VS_PREDICTED_KIND = "actual_vs_predicted"
+FEATURE_IMPORTANCE_KIND = "feature_importance"
+
+# One row per plotted point. group/row/col are the same labels the PNG file names encode:
+# ("patient: 1", "MR area", "LA area cm2") or ("classification", "MR area cm2", "feature importance").
+LABEL = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ("group", LABEL),
+    ("row", LABEL),
+    ("col", LABEL),
+    ("kind", LABEL),
+    ("x", pa.float64()),
+    ("y", pa.float64()),
+    ("label", pa.string()),
+])
+
+CHART_HEIGHT = 160
+
+
+def accept_header(result_format=RESULT_FORMAT):
+    if result_format == "arrow":
+        return f"{ARROW_STREAM}, application/zip;q=0.9"
+    return "application/zip"
+
+
+def write_table(table):
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class ResultTable:
+    # Numeric results (Arrow IPC stream) drawn as Altair charts instead of pre-rendered PNGs.
+
+    def __init__(self, data):
+        self.data = data
+        self.table = pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+
+        self.rows = OrderedDict()
+        labels = self.table.select(["group", "row", "col"]).to_pydict()
+        for i, key in enumerate(zip(labels["group"], labels["row"], labels["col"])):
+            self.rows.setdefault(key, []).append(i)
+
+        # group -> row -> col -> key, the same shape the ZIP indexes produce
+        self.index = OrderedDict()
+        for key in self.rows:
+            group, row, col = key
+            self.index.setdefault(group, OrderedDict()).setdefault(row, OrderedDict())[col] = key
+
+    def memory_size(self):
+        return len(self.data) + self.table.nbytes
+
+    def trim(self):
+        pass
+
+    def frame(self, key):
+        return self.table.take(np.asarray(self.rows[key])).to_pandas()
+
+    def chart(self, key):
+        frame = self.frame(key)
+        kind = frame["kind"].iloc[0]
+
+        if kind == CROSS_CORRELATION_KIND:
+            chart = alt.Chart(frame).mark_bar().encode(
+                x=alt.X("x:O", title="lag"),
+                y=alt.Y("y:Q", title="r", scale=alt.Scale(domain=[-1, 1])),
+                color=alt.condition(alt.datum.y > 0, alt.value("steelblue"), alt.value("crimson")),
+                tooltip=[alt.Tooltip("x:O", title="lag"), alt.Tooltip("y:Q", title="r", format=".3f")],
+            )
+        elif kind == FEATURE_IMPORTANCE_KIND:
+            chart = alt.Chart(frame).mark_bar().encode(
+                x=alt.X("y:Q", title="importance"),
+                y=alt.Y("label:N", title=None, sort="-x"),
+                tooltip=[alt.Tooltip("label:N", title="feature"), alt.Tooltip("y:Q", title="importance", format=".3f")],
+            )
+        else:
+            chart = alt.Chart(frame).mark_circle(size=30).encode(
+                x=alt.X("x:Q", title="actual"),
+                y=alt.Y("y:Q", title="predicted"),
+                tooltip=[alt.Tooltip("x:Q", title="actual"), alt.Tooltip("y:Q", title="predicted")],
+            )
+        return chart.properties(height=CHART_HEIGHT)
+
+
+def is_result(data):
+    # A ZIP or an Arrow stream; an empty body or a proxy's HTML page is neither, and is never cached
+    return bytes(data[:4]) in (LOCAL_HEADER_SIGNATURE, ARROW_STREAM_MAGIC)
+
+
+def open_result(data):
+    # The backend may answer with either format; cached payloads are told apart by their magic bytes.
+    if bytes(data[:4]) == ARROW_STREAM_MAGIC:
+        return ResultTable(data)
+    return ResultZip(data)
@@ -0,0 +1,256 @@
+import io
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+from PIL import Image
+
+from thumbnails import encode_thumbnail
+
+# Full-resolution images kept for the zoom dialog; grids are drawn from thumbnails
+DECODED_CACHE_SIZE = int(os.environ.get("PPI_DECODED_CACHE_SIZE", "32"))
+THUMBNAIL_CACHE_BUDGET = int(os.environ.get("PPI_THUMBNAIL_CACHE_MB", "64")) * 1024 * 1024
+
+
+def index_cross_correlation(names):
+    # patient -> row criteria -> col criteria -> ZIP entry name
+    patient_images = OrderedDict()
+    for file_name in names:
+        if file_name.endswith('.png'):
+            parts = file_name.split('_')
+            if len(parts) >= 5:
+                patient = parts[0] + ": " + parts[1]
+                row_criteria = parts[2] + " " + parts[3]
+                col_criteria = " ".join(parts[5:]).replace(".png", "")
+
+                if patient not in patient_images:
+                    patient_images[patient] = OrderedDict()
+
+                if row_criteria not in patient_images[patient]:
+                    patient_images[patient][row_criteria] = OrderedDict()
+
+                patient_images[patient][row_criteria][col_criteria] = file_name
+    return patient_images
+
+
+def patient_entries(names):
+    # Patient ID (as written in the file names) -> its ZIP entry names
+    patients = OrderedDict()
+    for file_name in names:
+        if file_name.endswith('.png'):
+            parts = file_name.split('_')
+            if len(parts) >= 5:
+                patients.setdefault(parts[1], []).append(file_name)
+    return patients
+
+
+def merge_patient_results(fingerprints, previous, changed, key, names):
+    # fingerprints: Patient ID -> fingerprint of this run's rows; previous: Patient ID -> (fingerprint, archive key,
+    # entry names) of the last run; the `changed` patients were sent again and answered with the entries `names`
+    # of the archive `key`. Returns the merged result as [(archive key, entry names)] in workbook order, and the
+    # patients to reuse next time. Sent patients without entries of their own are not reusable, so they are sent
+    # again; entries that match no sent patient (a backend numbering patients its own way) are still shown.
+    entries = patient_entries(names)
+    parts, patients, assigned = [], OrderedDict(), set()
+    for patient_id, fingerprint in fingerprints.items():
+        if patient_id not in changed:
+            patients[patient_id] = previous[patient_id]
+            parts.append(previous[patient_id][1:])
+        elif entries.get(patient_id):
+            patients[patient_id] = (fingerprint, key, entries[patient_id])
+            parts.append((key, entries[patient_id]))
+            assigned.update(entries[patient_id])
+
+    leftover = [name for name in names if name not in assigned]
+    if leftover:
+        parts.append((key, leftover))
+    return parts, patients
+
+
+def index_sources(sources, index_entries):
+    # Batch results: each source file indexed on its own, pages labelled "<file> · <page>"
+    images = OrderedDict()
+    for source, names in sources.items():
+        for page, grid in index_entries(names).items():
+            images[f"{source} · {page}"] = OrderedDict(
+                (row, OrderedDict((col, source_entry(source, name)) for col, name in col_data.items()))
+                for row, col_data in grid.items()
+            )
+    return images
+
+
+def source_entry(source, name):
+    return f"{source}::{name}" if source else name
+
+
+def index_analysis(names):
+    # analysis type -> target -> metric -> ZIP entry name
+    analysis_images = OrderedDict()
+    for file_name in names:
+        if file_name.endswith('.png'):
+            parts = file_name.split('_')
+            if len(parts) >= 4:
+                type = parts[0]
+                row_criteria = parts[1]
+                col_criteria = " ".join(parts[2:]).replace(".png", "")
+
+                if type not in analysis_images:
+                    analysis_images[type] = OrderedDict()
+
+                if row_criteria not in analysis_images[type]:
+                    analysis_images[type][row_criteria] = OrderedDict()
+
+                analysis_images[type][row_criteria][col_criteria] = file_name
+    return analysis_images
+
+
+class BufferReader(io.RawIOBase):
+    # Seekable read-only view over bytes or an mmap; slices are not copied until read.
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        size = max(min(len(buffer), len(self.view) - self.position), 0)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+
+class ResultZip:
+    # Keeps the backend ZIP compressed and decodes PNG entries only when a page draws them.
+    # `data` may be bytes or an mmap of the downloaded file; both are read in place.
+    # Further archives can be appended as partial results arrive; later entries replace earlier ones.
+    # Archives appended with a source (batch runs) keep their entries apart as "<source>::<entry>".
+    # `names` picks a subset of an archive's entries; appending the same archive again reuses its directory.
+
+    def __init__(self, data=None, decoded_cache_size=DECODED_CACHE_SIZE, thumbnail_cache_budget=THUMBNAIL_CACHE_BUDGET):
+        self.archives = []
+        self.zip_files = []
+        self.entries = OrderedDict()
+        self.sources = OrderedDict()
+        self.decoded_cache_size = decoded_cache_size
+        self.decoded = OrderedDict()
+        self.thumbnail_cache_budget = thumbnail_cache_budget
+        self.thumbnails = OrderedDict()
+        self.thumbnails_size = 0
+        self.lock = threading.Lock()
+
+        if data is not None:
+            self.append(data)
+
+    def append(self, data, source=None, names=None):
+        for archive, zip_file in zip(self.archives, self.zip_files):
+            if archive is data:
+                break
+        else:
+            zip_file = zipfile.ZipFile(BufferReader(data), 'r')
+            with self.lock:
+                self.archives.append(data)
+                self.zip_files.append(zip_file)
+
+        names = zip_file.namelist() if names is None else names
+        with self.lock:
+            if source is not None:
+                self.sources.setdefault(source, []).extend(names)
+            for name in names:
+                entry = source_entry(source, name)
+                if entry in self.entries:
+                    self._forget(entry)
+                self.entries[entry] = (zip_file, name)
+        return names
+
+    def _forget(self, name):
+        self.decoded.pop(name, None)
+        for key in [key for key in self.thumbnails if key[0] == name]:
+            self.thumbnails_size -= len(self.thumbnails.pop(key))
+
+    def namelist(self):
+        return list(self.entries)
+
+    def memory_size(self):
+        # Compressed archives plus what the caches currently hold; decoded images count their pixel buffers
+        with self.lock:
+            decoded_size = sum(image.width * image.height * len(image.getbands()) for image in self.decoded.values())
+            return sum(len(data) for data in self.archives) + decoded_size + self.thumbnails_size
+
+    def trim(self):
+        # Drops the caches; everything can be decoded again from the archives
+        with self.lock:
+            self.decoded.clear()
+            self.thumbnails.clear()
+            self.thumbnails_size = 0
+
+    def read(self, name):
+        # The entry's encoded bytes, e.g. to hand a PNG to another process
+        with self.lock:
+            zip_file, member = self.entries[name]
+            return zip_file.read(member)
+
+    def decode(self, name):
+        image = Image.open(io.BytesIO(self.read(name)))
+        image.load()
+        return image
+
+    def load_image(self, name):
+        with self.lock:
+            if name in self.decoded:
+                self.decoded.move_to_end(name)
+                return self.decoded[name]
+
+        image = self.decode(name)
+
+        with self.lock:
+            self.decoded[name] = image
+            while len(self.decoded) > self.decoded_cache_size:
+                self.decoded.popitem(last=False)
+        return image
+
+    def load_thumbnail(self, name, width):
+        # Display-sized JPEG bytes, encoded once per (entry, width)
+        key = (name, width)
+        with self.lock:
+            if key in self.thumbnails:
+                self.thumbnails.move_to_end(key)
+                return self.thumbnails[key]
+
+        # Pages are drawn from thumbnails, so the full-size decode is not kept
+        thumbnail = encode_thumbnail(self.decode(name), width)
+
+        with self.lock:
+            self._put_thumbnail(key, thumbnail)
+        return thumbnail
+
+    def add_thumbnails(self, thumbnails):
+        # Thumbnails encoded elsewhere from the same entries (the download preview), keyed like load_thumbnail's
+        with self.lock:
+            for key, thumbnail in thumbnails.items():
+                if key[0] in self.entries:
+                    self._put_thumbnail(key, thumbnail)
+
+    def _put_thumbnail(self, key, thumbnail):
+        if key not in self.thumbnails:
+            self.thumbnails[key] = thumbnail
+            self.thumbnails_size += len(thumbnail)
+        while self.thumbnails_size > self.thumbnail_cache_budget:
+            _, evicted = self.thumbnails.popitem(last=False)
+            self.thumbnails_size -= len(evicted)
@@ -0,0 +1,74 @@
+import io
+import struct
+import zipfile
+
+from PIL import Image
+
+from download import LOCAL_HEADER, PartialZip
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def archive(entries, method=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", method) as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+    return buffer.getvalue()
+
+
+ENTRIES = [
+    ("patient_1_MR_area_vs_LA_area.png", png("red")),
+    ("patient_1_MR_area_vs_LV_area.png", png("green")),
+    ("patient_2_MR_area_vs_LA_area.png", png("blue")),
+]
+
+
+def test_scan_in_small_chunks():
+    data = archive(ENTRIES)
+    spool = io.BytesIO()
+    partial_zip = PartialZip(spool)
+    seen = []
+    for start in range(0, len(data), 7):
+        spool.write(data[start:start + 7])
+        seen.extend(partial_zip.scan())
+
+    # Every entry reported once, in archive order, and readable from the spool
+    assert seen == [name for name, _ in ENTRIES]
+    assert partial_zip.done
+    for name, png_bytes in ENTRIES:
+        assert partial_zip.load_image(name).getpixel((0, 0)) == Image.open(io.BytesIO(png_bytes)).getpixel((0, 0))
+
+
+def test_scan_waits_for_a_truncated_entry():
+    data = archive(ENTRIES, zipfile.ZIP_STORED)
+    second = zipfile.ZipFile(io.BytesIO(data)).infolist()[1]
+    cut = second.header_offset + LOCAL_HEADER.size + len(second.filename) + second.compress_size // 2
+
+    spool = io.BytesIO()
+    partial_zip = PartialZip(spool)
+    spool.write(data[:cut])
+    assert partial_zip.scan() == [ENTRIES[0][0]]
+    assert not partial_zip.done
+
+    spool.write(data[cut:])
+    assert partial_zip.scan() == [name for name, _ in ENTRIES[1:]]
+
+
+def test_scan_stops_at_a_data_descriptor_entry():
+    data = bytearray(archive(ENTRIES))
+    # Mark the second entry as streamed: its sizes follow its data, so it cannot be indexed ahead
+    flags_offset = zipfile.ZipFile(io.BytesIO(bytes(data))).infolist()[1].header_offset + 6
+    flags, = struct.unpack_from("<H", data, flags_offset)
+    struct.pack_into("<H", data, flags_offset, flags | 0x08)
+
+    spool = io.BytesIO(bytes(data))
+    spool.seek(0, io.SEEK_END)
+    partial_zip = PartialZip(spool)
+    assert partial_zip.scan() == [ENTRIES[0][0]]
+    assert partial_zip.done
+    assert partial_zip.scan() == []
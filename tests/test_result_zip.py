@@ -0,0 +1,49 @@
+from result_zip import merge_patient_results
+
+
+def names(patient, count=2):
+    return [f"patient_{patient}_MR_area_vs_param_{col}.png" for col in range(count)]
+
+
+def test_full_run_records_every_patient():
+    fingerprints = {"1": "a", "2": "b"}
+    parts, patients = merge_patient_results(fingerprints, {}, {"1", "2"}, "new", names(1) + names(2))
+
+    assert parts == [("new", names(1)), ("new", names(2))]
+    assert patients == {"1": ("a", "new", names(1)), "2": ("b", "new", names(2))}
+
+
+def test_entries_numbered_by_the_backend_are_shown_but_not_reused():
+    # Workbook IDs 101/102, answered as patients 1 and 2
+    fingerprints = {"101": "a", "102": "b"}
+    parts, patients = merge_patient_results(fingerprints, {}, {"101", "102"}, "new", names(1) + names(2))
+
+    assert parts == [("new", names(1) + names(2))]
+    assert patients == {}
+
+
+def test_changed_patients_are_merged_in_workbook_order():
+    previous = {"1": ("a", "old", names(1)), "2": ("b", "old", names(2)), "3": ("c", "old", names(3))}
+    fingerprints = {"1": "a", "2": "B", "4": "d"}
+    parts, patients = merge_patient_results(fingerprints, previous, {"2", "4"}, "new", names(4) + names(2))
+
+    assert parts == [("old", names(1)), ("new", names(2)), ("new", names(4))]
+    # Patient 3 was deleted from the workbook
+    assert patients == {"1": previous["1"], "2": ("B", "new", names(2)), "4": ("d", "new", names(4))}
+
+
+def test_changed_patient_without_entries_is_sent_again():
+    previous = {"1": ("a", "old", names(1))}
+    fingerprints = {"1": "a", "2": "b"}
+    parts, patients = merge_patient_results(fingerprints, previous, {"2"}, "new", [])
+
+    assert parts == [("old", names(1))]
+    assert "2" not in patients
+
+
+def test_nothing_changed_reuses_every_archive():
+    previous = {"1": ("a", "old", names(1)), "2": ("b", "older", names(2))}
+    parts, patients = merge_patient_results({"1": "a", "2": "b"}, previous, set(), None, [])
+
+    assert parts == [("old", names(1)), ("older", names(2))]
+    assert patients == previous
@@ -0,0 +1,35 @@
+import io
+import os
+
+from PIL import Image
+
+# Content width of Streamlit's centered layout and the gap between st.columns
+PAGE_WIDTH = int(os.environ.get("PPI_PAGE_WIDTH", "704"))
+COLUMN_GAP = 16
+# Encode above the CSS width so thumbnails stay sharp on high-DPI screens
+THUMBNAIL_SCALE = float(os.environ.get("PPI_THUMBNAIL_SCALE", "2"))
+THUMBNAIL_QUALITY = int(os.environ.get("PPI_THUMBNAIL_QUALITY", "85"))
+
+
+def column_width(columns, page_width=PAGE_WIDTH):
+    return max((page_width - COLUMN_GAP * (columns - 1)) // columns, 1)
+
+
+def encode_thumbnail(image, width, scale=THUMBNAIL_SCALE):
+    # st.image passes JPEG bytes through untouched; any other format (WebP included) is re-encoded
+    # on every rerun, so thumbnails are flattened to RGB and stored as JPEG once.
+    pixels = int(width * scale)
+    if image.width > pixels:
+        image = image.resize((pixels, max(round(image.height * pixels / image.width), 1)), Image.LANCZOS)
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return buffer.getvalue()
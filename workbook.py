@@ -0,0 +1,155 @@
+import hashlib
+import io
+import os
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+
+import pandas as pd
+
+# "auto": Parquet only once the backend advertises it, "parquet" or "xlsx" to force one
+UPLOAD_FORMAT = os.environ.get("PPI_UPLOAD_FORMAT", "auto")
+PARQUET_MAGIC = b"PAR1"
+
+COLUMNS = [
+    "Patient ID", "Cycle", "Frame", "Time (moment)",
+    "MR area cm2", "MR VC mm", "LA area cm2", "LA length cm",
+    "MV tenting height mm", "MV annulus mm", "LV area cm2", "LV length cm",
+    "RR interval msec",
+]
+PARAMETERS = COLUMNS[4:12]
+INTEGER_COLUMNS = ["Patient ID", "Cycle", "Frame", "Time (moment)", "RR interval msec"]
+POSITIVE_COLUMNS = PARAMETERS + ["RR interval msec"]
+
+# Rows listed per problem in an error message
+MAX_REPORTED_ROWS = 5
+
+
+def excel_rows(mask):
+    # DataFrame index -> spreadsheet row number (row 1 is the header)
+    rows = [str(index + 2) for index in mask[mask].index[:MAX_REPORTED_ROWS]]
+    if mask.sum() > MAX_REPORTED_ROWS:
+        rows.append("...")
+    return ", ".join(rows)
+
+
+def validate_workbook(data):
+    # Checks the rules listed under "File constraints"; returns a list of messages, empty when valid
+    missing = [column for column in COLUMNS if column not in data.columns]
+    if missing:
+        return [f"Missing columns: {', '.join(missing)}"]
+
+    errors = []
+    for column in COLUMNS:
+        values = data[column]
+        empty = values.isna()
+        if empty.any():
+            errors.append(f"'{column}' has {empty.sum()} empty cells (rows {excel_rows(empty)})")
+
+        numbers = pd.to_numeric(values, errors="coerce")
+        not_numeric = numbers.isna() & ~empty
+        if not_numeric.any():
+            errors.append(f"'{column}' has non-numeric values (rows {excel_rows(not_numeric)})")
+
+        if column in INTEGER_COLUMNS:
+            not_integer = numbers.notna() & (numbers % 1 != 0)
+            if not_integer.any():
+                errors.append(f"'{column}' must contain integers (rows {excel_rows(not_integer)})")
+
+        if column in POSITIVE_COLUMNS:
+            not_positive = numbers <= 0
+            if not_positive.any():
+                errors.append(f"'{column}' must be positive (rows {excel_rows(not_positive)})")
+
+    if not errors:
+        duplicated = data.duplicated(["Patient ID", "Cycle", "Frame"], keep=False)
+        if duplicated.any():
+            errors.append(f"Patient ID, Cycle and Frame repeat across rows (rows {excel_rows(duplicated)})")
+    return errors
+
+
+def read_workbook(file_bytes):
+    if file_bytes[:4] == PARQUET_MAGIC:
+        return pd.read_parquet(io.BytesIO(file_bytes))
+    return pd.read_excel(io.BytesIO(file_bytes))
+
+
+@lru_cache(maxsize=4)
+def prepare_upload(file_bytes):
+    # Parsed once per uploaded file and shared by validation, the local engine and the Parquet upload
+    return parse_upload(file_bytes)
+
+
+def parse_upload(file_bytes):
+    # Uncached, for batches: their workbooks would only push the single upload out of prepare_upload's cache
+    data = read_workbook(file_bytes)
+    errors = validate_workbook(data)
+    if not errors:
+        data = data[COLUMNS].astype({column: "int64" for column in INTEGER_COLUMNS})
+        data = data.astype({column: "float64" for column in PARAMETERS})
+    return data, errors
+
+
+def frame_parquet(data):
+    buffer = io.BytesIO()
+    data.to_parquet(buffer, index=False, compression="zstd")
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=4)
+def upload_parquet(file_bytes):
+    data, _ = prepare_upload(file_bytes)
+    return frame_parquet(data)
+
+
+def upload_workbook(file_bytes):
+    # For backends that only read .xlsx; Parquet uploads (patient subsets) are converted only then
+    if file_bytes[:4] != PARQUET_MAGIC:
+        return file_bytes
+    buffer = io.BytesIO()
+    pd.read_parquet(io.BytesIO(file_bytes)).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def patient_fingerprints(data):
+    # Patient ID -> digest of that patient's rows (data as returned by prepare_upload); row order does not matter
+    fingerprints = OrderedDict()
+    for patient_id, rows in data.groupby("Patient ID", sort=False):
+        rows = rows.sort_values(["Cycle", "Frame"])
+        hashed = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+        fingerprints[str(patient_id)] = hashlib.sha256(hashed.tobytes()).hexdigest()
+    return fingerprints
+
+
+def patient_parquet(data, patient_ids):
+    # The given patients' rows as Parquet, sent in place of the whole workbook
+    return frame_parquet(data[data["Patient ID"].astype(str).isin(patient_ids)])
+
+
+def parquet_name(file_name):
+    return os.path.splitext(file_name)[0] + ".parquet"
+
+
+def expand_batch(files):
+    # (name, bytes) of uploaded .xlsx files and .zip folders -> (name, bytes) of every workbook, names made unique
+    workbooks = []
+    for name, data in files:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for member in archive.infolist():
+                    base_name = os.path.basename(member.filename)
+                    if member.is_dir() or not base_name.lower().endswith(".xlsx"):
+                        continue
+                    # Skip macOS resource forks and Excel lock files
+                    if member.filename.startswith("__MACOSX/") or base_name.startswith(("._", "~$")):
+                        continue
+                    workbooks.append((member.filename, archive.read(member)))
+        else:
+            workbooks.append((name, data))
+
+    seen = {}
+    unique = []
+    for name, data in workbooks:
+        seen[name] = seen.get(name, 0) + 1
+        unique.append((name if seen[name] == 1 else f"{name} ({seen[name]})", data))
+    return unique